@@ -4,13 +4,39 @@ import os
 import re
 import json
 import uuid
+import time
+import base64
+import gzip
+import zlib
+import email.utils
+import random
+import struct
+import unicodedata
+import math
+import tempfile
+import shutil
+import urllib.request
+import urllib.error
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from flask import Flask, Response, g, render_template, jsonify, request, session, redirect, url_for, stream_with_context
 from apscheduler.schedulers.background import BackgroundScheduler
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values, Json
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+from contextlib import contextmanager
 import anthropic
-from collections import defaultdict
+import numpy as np
+import scipy.sparse as sp
+try:
+    import brotli  # opzionale: senza, le risposte si comprimono solo in gzip
+except ImportError:
+    brotli = None
+from collections import Counter, defaultdict, OrderedDict, deque
+from functools import wraps
+import hashlib
+import socket
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "theatrum-belli-secret-2026")
@@ -21,108 +47,974 @@ from datetime import timedelta
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "theatrum2026")
 ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY", "")
 DATABASE_URL = os.environ.get("DATABASE_URL", "")
-
-jobs = {}
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+# Da incrementare a ogni modifica del prompt: invalida la cache delle analisi
+PROMPT_VERSION = 2
+ANALYSIS_CACHE_MAX_AGE_HOURS = float(os.environ.get("ANALYSIS_CACHE_MAX_AGE_HOURS", 72))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", 200))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_RUNNING = int(os.environ.get("JOB_MAX_RUNNING", 2))
+JOB_TTL_HOURS = float(os.environ.get("JOB_TTL_HOURS", 24))
+JOB_STALE_SECONDS = int(os.environ.get("JOB_STALE_SECONDS", 300))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+CLAUDE_CONCURRENCY = int(os.environ.get("CLAUDE_CONCURRENCY", 2))
+# Governor delle chiamate Claude (finestra di 60 s condivisa via Postgres fra tutti i
+# processi e i worker gunicorn): 0 = nessun limite
+CLAUDE_RPM = int(os.environ.get("CLAUDE_RPM", 50))
+CLAUDE_TPM = int(os.environ.get("CLAUDE_TPM", 30000))   # token di input al minuto
+CLAUDE_MAX_RETRIES = int(os.environ.get("CLAUDE_MAX_RETRIES", 4))
+BATCH_MAX_TOPICS = int(os.environ.get("BATCH_MAX_TOPICS", 8))
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 6))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_HEALTHCHECK_IDLE = float(os.environ.get("DB_HEALTHCHECK_IDLE", 30))
+DB_SSLMODE = os.environ.get("DB_SSLMODE", "require")   # "disable" per un Postgres locale
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", 8))
+FETCH_TIMEOUT = float(os.environ.get("FETCH_TIMEOUT", 15))
+FETCH_USER_AGENT = "TheatrumBelli/1.0 (+feedparser)"
+# Polling adattivo per fonte: intervallo stimato dal ritmo di pubblicazione, entro questi limiti
+FEED_MIN_INTERVAL = int(os.environ.get("FEED_MIN_INTERVAL", 300))
+FEED_MAX_INTERVAL = int(os.environ.get("FEED_MAX_INTERVAL", 6 * 3600))
+FEED_DEFAULT_INTERVAL = 3600
+FEED_BACKOFF_MAX = int(os.environ.get("FEED_BACKOFF_MAX", 24 * 3600))
+FEED_RATE_ALPHA = 0.3   # peso dell'ultima osservazione nella media mobile del ritmo
+SCHEDULER_TICK_SECONDS = 60
+# Date nel futuro oltre questa tolleranza (fusi sbagliati, refusi dei feed) vengono riportate all'ora del fetch
+PUBLISHED_FUTURE_TOLERANCE = timedelta(minutes=10)
+# Finestra di default delle analisi: solo copertura recente (0 = tutto l'archivio)
+ANALYSIS_WINDOW_HOURS = float(os.environ.get("ANALYSIS_WINDOW_HOURS", 168))
+# Split caldo/freddo: oltre ARTICLES_HOT_DAYS gli articoli passano, compattati, in articles_archive;
+# ARCHIVE_RETENTION_DAYS > 0 elimina anche l'archivio più vecchio
+ARTICLES_HOT_DAYS = int(os.environ.get("ARTICLES_HOT_DAYS", 30))
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("ARCHIVE_RETENTION_DAYS", 0))
+ARCHIVE_BATCH = 5000
 
 # ─────────────────────────────────────────────
 # DATABASE
 # ─────────────────────────────────────────────
-def get_conn():
-    return psycopg2.connect(DATABASE_URL, sslmode="require")
+# Pool thread-safe condiviso da route, fetch_all e job di analisi.
+# ThreadedConnectionPool non attende quando è pieno: il semaforo rende il checkout bloccante.
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "checkouts": 0, "in_use": 0, "max_in_use": 0, "timeouts": 0, "reconnects": 0,
+    "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+}
+_conn_last_used = {}
 
 
-def init_db():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS articles (
-            id SERIAL PRIMARY KEY,
-            source TEXT,
-            title TEXT,
-            link TEXT UNIQUE,
-            summary TEXT,
-            published TEXT,
-            category TEXT,
-            perspective TEXT,
-            fetched_at TEXT
-        )
-    """)
-    c.execute("""
-        ALTER TABLE articles ADD COLUMN IF NOT EXISTS perspective TEXT DEFAULT 'other'
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS analyses (
-            id SERIAL PRIMARY KEY,
-            keywords TEXT,
-            article_count INTEGER,
-            narrative_map TEXT,
-            convergences TEXT,
-            divergences TEXT,
-            legal TEXT,
-            thread TEXT,
-            instagram_script TEXT,
-            created_at TEXT
-        )
-    """)
-    for col in ["narrative_map", "convergences", "divergences", "thread", "instagram_script", "legal"]:
-        c.execute(f"ALTER TABLE analyses ADD COLUMN IF NOT EXISTS {col} TEXT")
-    source_map = {
-        "ANSA Mondo": "italian_mainstream", "Repubblica Esteri": "italian_mainstream",
-        "Corriere Esteri": "italian_mainstream", "Il Sole 24 Ore Mondo": "italian_mainstream",
-        "Il Fatto Quotidiano Esteri": "italian_mainstream", "Limes": "think_tank",
-        "BBC World": "western_mainstream", "Reuters World": "western_mainstream",
-        "The Guardian World": "western_mainstream", "AP News": "western_mainstream",
-        "DW World": "western_mainstream", "France24 EN": "western_mainstream",
-        "Euronews EN": "western_mainstream", "Jerusalem Post": "pro_israel",
-        "Times of Israel": "pro_israel", "Haaretz EN": "pro_israel", "i24 News": "pro_israel",
-        "Al Jazeera English": "arab_media", "Middle East Eye": "arab_media",
-        "The Cradle": "alternative_left", "MintPress News": "alternative_left",
-        "Multipolarista": "alternative_left", "Consortium News": "alternative_left",
-        "Antiwar.com": "alternative_left", "Responsible Statecraft": "alternative_left",
-        "Scenari Economici": "alternative_left", "TASS English": "russian_state",
-        "RT World": "russian_state", "Sputnik World": "russian_state",
-        "Global Times EN": "chinese_state", "CGTN World": "chinese_state",
-        "SCMP World": "chinese_state", "ISW": "think_tank",
-        "Foreign Affairs": "think_tank", "The Diplomat": "think_tank",
-        "Defense One": "think_tank", "War on the Rocks": "think_tank",
-        "Geopolitical Futures": "think_tank",
-    }
-    for source, persp in source_map.items():
-        c.execute("UPDATE articles SET perspective = %s WHERE source = %s AND (perspective IS NULL OR perspective = 'other')", (persp, source))
-    conn.commit()
-    conn.close()
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL, sslmode=DB_SSLMODE)
+    return _pool
 
 
-def save_article(source, title, link, summary, published, category, perspective):
-    conn = get_conn()
-    c = conn.cursor()
+def _checkout(pool):
+    conn = pool.getconn()
+    last_used = _conn_last_used.get(id(conn))
+    if conn.closed or (last_used is not None and time.monotonic() - last_used > DB_HEALTHCHECK_IDLE):
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connessione chiusa")
+            with conn.cursor() as c:
+                c.execute("SELECT 1")
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            _conn_last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            with _pool_stats_lock:
+                _pool_stats["reconnects"] += 1
+            conn = pool.getconn()
+    return conn
+
+
+@contextmanager
+def db():
+    started = time.monotonic()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        with _pool_stats_lock:
+            _pool_stats["timeouts"] += 1
+        raise PoolError("Pool DB esaurito")
+    waited = (time.monotonic() - started) * 1000
+    pool = None
+    conn = None
     try:
+        pool = _get_pool()
+        conn = _checkout(pool)
+        with _pool_stats_lock:
+            _pool_stats["checkouts"] += 1
+            _pool_stats["in_use"] += 1
+            _pool_stats["max_in_use"] = max(_pool_stats["max_in_use"], _pool_stats["in_use"])
+            _pool_stats["wait_ms_total"] += waited
+            _pool_stats["wait_ms_max"] = max(_pool_stats["wait_ms_max"], waited)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            with _pool_stats_lock:
+                _pool_stats["in_use"] -= 1
+    finally:
+        if conn is not None:
+            if conn.closed:
+                _conn_last_used.pop(id(conn), None)
+            else:
+                _conn_last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+        _pool_slots.release()
+
+
+def pool_stats():
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    stats["size"] = DB_POOL_MAX
+    stats["wait_ms_avg"] = round(stats["wait_ms_total"] / stats["checkouts"], 2) if stats["checkouts"] else 0.0
+    stats["wait_ms_total"] = round(stats["wait_ms_total"], 2)
+    stats["wait_ms_max"] = round(stats["wait_ms_max"], 2)
+    return stats
+
+
+# Da incrementare a ogni modifica di init_db: i processi migrano solo se la versione è cambiata
+SCHEMA_VERSION = 9
+SCHEMA_LOCK = 7302  # chiave advisory: una sola migrazione alla volta fra tutti i processi
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _schema_version(c):
+    c.execute("SELECT to_regclass('schema_version')")
+    if c.fetchone()[0] is None:
+        return 0
+    c.execute("SELECT version FROM schema_version WHERE id = 1")
+    row = c.fetchone()
+    return row[0] if row else 0
+
+
+def ensure_schema():
+    # Percorso veloce in sola lettura: una SELECT per processo se lo schema è già aggiornato
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with db() as conn:
+            current = _schema_version(conn.cursor())
+        if current < SCHEMA_VERSION:
+            init_db()
+        _schema_ready = True
+
+
+def init_db():
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK,))
+        if _schema_version(c) >= SCHEMA_VERSION:
+            return False
+        print(f"[DB] migrazione dello schema alla versione {SCHEMA_VERSION}...")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS articles (
+                id SERIAL PRIMARY KEY,
+                source TEXT,
+                title TEXT,
+                link TEXT UNIQUE,
+                summary TEXT,
+                published TEXT,
+                category TEXT,
+                perspective TEXT,
+                fetched_at TEXT
+            )
+        """)
+        c.execute("""
+            ALTER TABLE articles ADD COLUMN IF NOT EXISTS perspective TEXT DEFAULT 'other'
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                id SERIAL PRIMARY KEY,
+                keywords TEXT,
+                article_count INTEGER,
+                narrative_map TEXT,
+                convergences TEXT,
+                divergences TEXT,
+                legal TEXT,
+                thread TEXT,
+                instagram_script TEXT,
+                created_at TEXT
+            )
+        """)
+        for col in ["narrative_map", "convergences", "divergences", "thread", "instagram_script", "legal"]:
+            c.execute(f"ALTER TABLE analyses ADD COLUMN IF NOT EXISTS {col} TEXT")
+        # Consumo token e latenza per analisi, per misurare l'effetto del prompt caching
+        for col in ["input_tokens", "cache_read_tokens", "cache_write_tokens", "output_tokens", "latency_ms"]:
+            c.execute(f"ALTER TABLE analyses ADD COLUMN IF NOT EXISTS {col} INTEGER")
+        # Modalità incrementale: link usati, istante della selezione e analisi di partenza
+        c.execute("ALTER TABLE analyses ADD COLUMN IF NOT EXISTS article_links JSONB")
+        c.execute("ALTER TABLE analyses ADD COLUMN IF NOT EXISTS articles_until timestamptz")
+        c.execute("ALTER TABLE analyses ADD COLUMN IF NOT EXISTS base_id INTEGER REFERENCES analyses(id) ON DELETE SET NULL")
+        # Stato per fonte: validator HTTP per GET condizionali + esito dell'ultimo fetch
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS feed_state (
+                source TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                last_status INTEGER,
+                last_error TEXT,
+                last_duration_ms INTEGER,
+                last_entries INTEGER,
+                last_fetched_at TEXT
+            )
+        """)
+        source_map = {
+            "ANSA Mondo": "italian_mainstream", "Repubblica Esteri": "italian_mainstream",
+            "Corriere Esteri": "italian_mainstream", "Il Sole 24 Ore Mondo": "italian_mainstream",
+            "Il Fatto Quotidiano Esteri": "italian_mainstream", "Limes": "think_tank",
+            "BBC World": "western_mainstream", "Reuters World": "western_mainstream",
+            "The Guardian World": "western_mainstream", "AP News": "western_mainstream",
+            "DW World": "western_mainstream", "France24 EN": "western_mainstream",
+            "Euronews EN": "western_mainstream", "Jerusalem Post": "pro_israel",
+            "Times of Israel": "pro_israel", "Haaretz EN": "pro_israel", "i24 News": "pro_israel",
+            "Al Jazeera English": "arab_media", "Middle East Eye": "arab_media",
+            "The Cradle": "alternative_left", "MintPress News": "alternative_left",
+            "Multipolarista": "alternative_left", "Consortium News": "alternative_left",
+            "Antiwar.com": "alternative_left", "Responsible Statecraft": "alternative_left",
+            "Scenari Economici": "alternative_left", "TASS English": "russian_state",
+            "RT World": "russian_state", "Sputnik World": "russian_state",
+            "Global Times EN": "chinese_state", "CGTN World": "chinese_state",
+            "SCMP World": "chinese_state", "ISW": "think_tank",
+            "Foreign Affairs": "think_tank", "The Diplomat": "think_tank",
+            "Defense One": "think_tank", "War on the Rocks": "think_tank",
+            "Geopolitical Futures": "think_tank",
+        }
+        for source, persp in source_map.items():
+            c.execute("UPDATE articles SET perspective = %s WHERE source = %s AND (perspective IS NULL OR perspective = 'other')", (persp, source))
+        # Ricerca full-text: tsvector generato (titolo peso A, sommario peso B) in
+        # italiano e inglese, indicizzato GIN — sostituisce le catene di LIKE '%kw%'
         c.execute("""
+            ALTER TABLE articles ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('italian', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('italian', coalesce(summary, '')), 'B') ||
+                setweight(to_tsvector('english', coalesce(summary, '')), 'B')
+            ) STORED
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS articles_search_idx ON articles USING GIN (search_tsv)")
+        c.execute("""
+            ALTER TABLE analyses ADD COLUMN IF NOT EXISTS keywords_tsv tsvector GENERATED ALWAYS AS (
+                to_tsvector('simple', coalesce(keywords, ''))
+            ) STORED
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS analyses_keywords_idx ON analyses USING GIN (keywords_tsv)")
+        # Timestamp veri al posto del TEXT: i valori non interpretabili diventano NULL
+        c.execute("""
+            CREATE OR REPLACE FUNCTION try_timestamptz(value TEXT) RETURNS timestamptz AS $$
+            BEGIN
+                RETURN value::timestamptz;
+            EXCEPTION WHEN others THEN
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql STABLE
+        """)
+        for col in ["fetched_at", "published"]:
+            c.execute("""SELECT data_type FROM information_schema.columns
+                         WHERE table_schema = current_schema() AND table_name = 'articles'
+                           AND column_name = %s""", (col,))
+            if c.fetchone()[0] == "text":
+                c.execute(f"ALTER TABLE articles ALTER COLUMN {col} TYPE timestamptz USING try_timestamptz({col})")
+        c.execute("ALTER TABLE articles ALTER COLUMN fetched_at SET DEFAULT now()")
+        # published sempre valorizzato e mai nel futuro: stessa normalizzazione di entry_time
+        c.execute("UPDATE articles SET published = fetched_at WHERE published IS NULL")
+        c.execute("UPDATE articles SET published = fetched_at WHERE published > fetched_at + %s",
+                  (PUBLISHED_FUTURE_TOLERANCE,))
+        c.execute("CREATE INDEX IF NOT EXISTS articles_published_idx ON articles (published DESC, id DESC)")
+        # Indici per la paginazione keyset di /api/news, con e senza filtri
+        c.execute("CREATE INDEX IF NOT EXISTS articles_fetched_idx ON articles (fetched_at DESC, id DESC)")
+        c.execute("CREATE INDEX IF NOT EXISTS articles_category_fetched_idx ON articles (category, fetched_at DESC, id DESC)")
+        c.execute("CREATE INDEX IF NOT EXISTS articles_source_fetched_idx ON articles (source, fetched_at DESC, id DESC)")
+        # Contatori mantenuti dall'ingestione: /api/stats non fa più GROUP BY sull'archivio
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS article_stats (
+                category TEXT,
+                source TEXT,
+                n INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (category, source)
+            )
+        """)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS stats_meta (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version BIGINT NOT NULL,
+                last_update timestamptz
+            )
+        """)
+        # Coda dei job di analisi: visibile da tutti i worker, sopravvive ai riavvii
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'pending',
+                payload JSONB NOT NULL,
+                result JSONB,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                created_at timestamptz NOT NULL DEFAULT now(),
+                started_at timestamptz,
+                heartbeat_at timestamptz,
+                finished_at timestamptz
+            )
+        """)
+        c.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS partial TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS jobs_pending_idx ON jobs (created_at) WHERE status = 'pending'")
+        # Analisi multi-tema: i job dello stesso batch si raccolgono insieme
+        c.execute("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS batch_id TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS jobs_batch_idx ON jobs (batch_id) WHERE batch_id IS NOT NULL")
+        # Governor Claude: finestra di 60 s condivisa da tutti i processi (una riga per chiamata)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS claude_calls (
+                id BIGSERIAL PRIMARY KEY,
+                at timestamptz NOT NULL DEFAULT clock_timestamp(),
+                tokens INTEGER NOT NULL
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS claude_calls_at_idx ON claude_calls (at)")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS claude_governor (
+                id INTEGER PRIMARY KEY,
+                paused_until timestamptz
+            )
+        """)
+        c.execute("INSERT INTO claude_governor (id) VALUES (1) ON CONFLICT (id) DO NOTHING")
+        # Cache content-addressed delle analisi: stesso set di articoli → stesso risultato
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                cache_key TEXT PRIMARY KEY,
+                analysis_id INTEGER REFERENCES analyses(id) ON DELETE CASCADE,
+                result JSONB NOT NULL,
+                created_at timestamptz NOT NULL DEFAULT now(),
+                last_hit_at timestamptz,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Cluster di storie quasi identiche: firma MinHash e id del primo articolo del cluster
+        c.execute("ALTER TABLE articles ADD COLUMN IF NOT EXISTS cluster_id INTEGER")
+        c.execute("ALTER TABLE articles ADD COLUMN IF NOT EXISTS minhash BYTEA")
+        c.execute("CREATE INDEX IF NOT EXISTS articles_cluster_idx ON articles (cluster_id, fetched_at DESC, id DESC)")
+        # Scheduling adattivo: ritmo stimato (item/ora), intervallo corrente, errori consecutivi
+        c.execute("ALTER TABLE feed_state ADD COLUMN IF NOT EXISTS latest_entry_at timestamptz")
+        c.execute("ALTER TABLE feed_state ADD COLUMN IF NOT EXISTS rate REAL")
+        c.execute("ALTER TABLE feed_state ADD COLUMN IF NOT EXISTS interval_s INTEGER")
+        c.execute("ALTER TABLE feed_state ADD COLUMN IF NOT EXISTS error_count INTEGER NOT NULL DEFAULT 0")
+        c.execute("ALTER TABLE feed_state ADD COLUMN IF NOT EXISTS next_fetch_at timestamptz")
+        # Archivio freddo: solo ciò che serve a citare le fonti delle analisi passate
+        # (niente sommario né firme), ricercabile sul titolo
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS articles_archive (
+                id INTEGER PRIMARY KEY,
+                source TEXT,
+                title TEXT,
+                link TEXT UNIQUE,
+                published timestamptz,
+                fetched_at timestamptz,
+                category TEXT,
+                perspective TEXT,
+                cluster_id INTEGER,
+                archived_at timestamptz NOT NULL DEFAULT now(),
+                title_tsv tsvector GENERATED ALWAYS AS (
+                    to_tsvector('italian', coalesce(title, '')) || to_tsvector('english', coalesce(title, ''))
+                ) STORED
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS articles_archive_search_idx ON articles_archive USING GIN (title_tsv)")
+        c.execute("CREATE INDEX IF NOT EXISTS articles_archive_published_idx ON articles_archive (published)")
+        c.execute("ALTER TABLE stats_meta ADD COLUMN IF NOT EXISTS archived BIGINT NOT NULL DEFAULT 0")
+        # Trend: uno sketch per ora di ingestione, scritto da save_articles
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS trend_buckets (
+                bucket timestamptz PRIMARY KEY,
+                sketch BYTEA NOT NULL,
+                heavy JSONB NOT NULL,
+                docs JSONB NOT NULL,
+                updated_at timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+        # Metriche di ingestione: un ciclo per riga, il dettaglio per fonte in feed_metrics
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_cycles (
+                id SERIAL PRIMARY KEY,
+                started_at timestamptz NOT NULL,
+                total_ms INTEGER, fetch_ms INTEGER, parse_ms INTEGER,
+                filter_ms INTEGER, db_ms INTEGER, state_ms INTEGER
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS ingest_cycles_started_idx ON ingest_cycles (started_at)")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS feed_metrics (
+                id BIGSERIAL PRIMARY KEY,
+                cycle_id INTEGER NOT NULL REFERENCES ingest_cycles(id) ON DELETE CASCADE,
+                cycle_at timestamptz NOT NULL,
+                source TEXT NOT NULL,
+                status INTEGER,
+                error TEXT,
+                fetch_ms INTEGER, parse_ms INTEGER, bytes INTEGER,
+                parsed INTEGER, relevant INTEGER, inserted INTEGER, duplicates INTEGER
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS feed_metrics_cycle_idx ON feed_metrics (cycle_id)")
+        c.execute("SELECT 1 FROM stats_meta")
+        if not c.fetchone():
+            c.execute("""
+                INSERT INTO article_stats (category, source, n)
+                SELECT COALESCE(category, ''), COALESCE(source, ''), COUNT(*) FROM articles GROUP BY 1, 2
+                ON CONFLICT (category, source) DO UPDATE SET n = EXCLUDED.n
+            """)
+            c.execute("INSERT INTO stats_meta (id, version, last_update) SELECT 1, 1, MAX(fetched_at) FROM articles")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL,
+                migrated_at timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+        c.execute("""
+            INSERT INTO schema_version (id, version) VALUES (1, %s)
+            ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, migrated_at = now()
+        """, (SCHEMA_VERSION,))
+    return True
+
+
+def _insert_articles(c, values, now):
+    # Inserimento di un blocco di righe dentro un savepoint: se fallisce si annulla solo
+    # questo blocco, la transazione del ciclo resta utilizzabile
+    c.execute("SAVEPOINT insert_articles")
+    try:
+        # Un link già finito in archivio non va reinserito tra gli articoli caldi
+        c.execute("SELECT link FROM articles_archive WHERE link = ANY(%s)", ([v[2] for v in values],))
+        archived = {link for (link,) in c.fetchall()}
+        if archived:
+            values = [v for v in values if v[2] not in archived]
+        inserted = execute_values(c, """
             INSERT INTO articles (source, title, link, summary, published, category, perspective, fetched_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            VALUES %s
             ON CONFLICT (link) DO NOTHING
-        """, (source, title, link[:500] if link else "",
-              summary[:500] if summary else "",
-              published, category, perspective,
-              datetime.now(timezone.utc).isoformat()))
-        conn.commit()
+            RETURNING id, link, category, source
+        """, values, page_size=500, fetch=True) if values else []
+        if inserted:
+            bump_stats(c, [(category, source) for _, _, category, source in inserted], now)
+            # Solo le righe nuove passano dal clustering: i duplicati esatti sono già fuori.
+            # Un errore qui lascia gli articoli senza cluster ma non ne annulla l'inserimento
+            texts = {v[2]: (v[1], v[3]) for v in values}
+            c.execute("SAVEPOINT assign_clusters")
+            try:
+                clusters = assign_clusters(c, [(id_, *texts[link]) for id_, link, _, _ in inserted], now)
+                execute_values(c, """
+                    UPDATE articles SET cluster_id = v.cluster_id, minhash = v.minhash
+                    FROM (VALUES %s) AS v(id, cluster_id, minhash)
+                    WHERE articles.id = v.id
+                """, clusters, template="(%s, %s, %s::bytea)", page_size=500)
+            except Exception as e:
+                c.execute("ROLLBACK TO SAVEPOINT assign_clusters")
+                reset_cluster_index()
+                print(f"[CLUSTER] errore, articoli salvati senza cluster: {e}")
+            c.execute("RELEASE SAVEPOINT assign_clusters")
+    except Exception:
+        c.execute("ROLLBACK TO SAVEPOINT insert_articles")
+        reset_cluster_index()
+        raise
+    c.execute("RELEASE SAVEPOINT insert_articles")
+    return inserted
+
+
+def save_articles(rows):
+    # rows: (source, title, link, summary, published, category, perspective)
+    # Un'unica transazione per ciclo; ritorna le righe davvero inserite per fonte e le fonti
+    # il cui inserimento è fallito
+    inserted_by_source = defaultdict(int)
+    if not rows:
+        return inserted_by_source, set()
+    now = datetime.now(timezone.utc)
+    values = [(source, title, link[:500] if link else "", summary[:500] if summary else "",
+               published, category, perspective, now)
+              for source, title, link, summary, published, category, perspective in rows]
+    failed = set()
+    try:
+        with db() as conn:
+            c = conn.cursor()
+            try:
+                inserted = _insert_articles(c, values, now)
+            except Exception as e:
+                # Una riga difettosa (byte NUL, valore fuori range) non deve costare l'intero
+                # ciclo: si riprova fonte per fonte e si scarta solo quella che fallisce
+                print(f"DB error: {e} — riprovo fonte per fonte")
+                by_source = defaultdict(list)
+                for v in values:
+                    by_source[v[0]].append(v)
+                inserted = []
+                for source, group in by_source.items():
+                    try:
+                        inserted += _insert_articles(c, group, now)
+                    except Exception as e:
+                        failed.add(source)
+                        print(f"  [{source}] DB error: {e}")
+            if inserted:
+                # I trend sono derivati: un errore qui non deve annullare gli articoli inseriti
+                texts = {v[2]: (v[1], v[6]) for v in values}
+                c.execute("SAVEPOINT record_trends")
+                try:
+                    record_trends(c, [texts[link] for _, link, _, _ in inserted], now)
+                except Exception as e:
+                    c.execute("ROLLBACK TO SAVEPOINT record_trends")
+                    print(f"[TREND] errore aggiornamento: {e}")
+                c.execute("RELEASE SAVEPOINT record_trends")
+        if inserted:
+            invalidate_stats()
+            invalidate_responses()
+        for _, _, _, source in inserted:
+            inserted_by_source[source] += 1
+        return inserted_by_source, failed
     except Exception as e:
+        reset_cluster_index()
         print(f"DB error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+        return defaultdict(int), {v[0] for v in values}
+
+
+def load_feed_states():
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute("""SELECT source, etag, last_modified, last_fetched_at, latest_entry_at,
+                            rate, interval_s, error_count, next_fetch_at
+                     FROM feed_state""")
+        states = {r["source"]: dict(r) for r in c.fetchall()}
+    return states
+
+
+def save_feed_states(results, states):
+    with db() as conn:
+        c = conn.cursor()
+        now = datetime.now(timezone.utc)
+        for r in results:
+            plan = plan_next_fetch(states.get(r["source"]), r, now)
+            c.execute("""
+                INSERT INTO feed_state (source, etag, last_modified, last_status, last_error,
+                                        last_duration_ms, last_entries, last_fetched_at,
+                                        latest_entry_at, rate, interval_s, error_count, next_fetch_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (source) DO UPDATE SET
+                    etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified,
+                    last_status = EXCLUDED.last_status, last_error = EXCLUDED.last_error,
+                    last_duration_ms = EXCLUDED.last_duration_ms, last_entries = EXCLUDED.last_entries,
+                    last_fetched_at = EXCLUDED.last_fetched_at,
+                    latest_entry_at = COALESCE(EXCLUDED.latest_entry_at, feed_state.latest_entry_at),
+                    rate = EXCLUDED.rate, interval_s = EXCLUDED.interval_s,
+                    error_count = EXCLUDED.error_count, next_fetch_at = EXCLUDED.next_fetch_at
+            """, (r["source"], r["etag"], r["last_modified"], r["status"], r["error"],
+                  r["duration_ms"], len(r["entries"]), now.isoformat(), r.get("newest_entry_at"),
+                  plan["rate"], plan["interval_s"], plan["error_count"], plan["next_fetch_at"]))
+
+
+def save_analysis(keywords, article_count, narrative_map, convergences, divergences, legal, thread, instagram_script,
+                  usage=None, article_links=None, articles_until=None, base_id=None):
+    usage = usage or {}
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO analyses (keywords, article_count, narrative_map, convergences, divergences, legal, thread, instagram_script, created_at,
+                                  input_tokens, cache_read_tokens, cache_write_tokens, output_tokens, latency_ms,
+                                  article_links, articles_until, base_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        """, (keywords, article_count, narrative_map, convergences, divergences, legal, thread, instagram_script,
+              datetime.now(timezone.utc).isoformat(),
+              usage.get("input_tokens"), usage.get("cache_read_tokens"), usage.get("cache_write_tokens"),
+              usage.get("output_tokens"), usage.get("latency_ms"),
+              Json(article_links) if article_links is not None else None, articles_until, base_id))
+        return c.fetchone()[0]
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def encode_cursor(fetched_at, article_id):
+    raw = f"{fetched_at.isoformat()}|{article_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    fetched_at, article_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(fetched_at), int(article_id)
+
+
+def _articles_tsquery(keywords):
+    # OR delle keyword, ognuna analizzata con entrambe le configurazioni linguistiche
+    sql = " || ".join("(websearch_to_tsquery('italian', %s) || websearch_to_tsquery('english', %s))"
+                      for _ in keywords)
+    return sql, [p for kw in keywords for p in (kw, kw)]
+
+
+def _search_hits_sql(query_ref, since=None, fetched_after=None):
+    # UNION delle corrispondenze per la tsquery query_ref (colonna di una FROM esterna).
+    # L'archivio freddo entra in gioco solo se la finestra va oltre l'orizzonte caldo;
+    # fetched_after limita agli articoli ingeriti dopo un istante (analisi incrementale)
+    window = ""
+    window_params = []
+    if since:
+        window += " AND published >= %s"
+        window_params.append(since)
+    if fetched_after:
+        window += " AND fetched_at > %s"
+        window_params.append(fetched_after)
+    sql = f"""SELECT source, title, link, summary, published, category, perspective, cluster_id,
+                     ts_rank_cd(search_tsv, {query_ref}) AS rank, id
+              FROM articles WHERE search_tsv @@ {query_ref} {window}"""
+    params = list(window_params)
+    horizon = hot_horizon()
+    if (not since or since < horizon) and (not fetched_after or fetched_after < horizon):
+        sql += f"""
+              UNION ALL
+              SELECT source, title, link, '' AS summary, published, category, perspective, cluster_id,
+                     ts_rank_cd(title_tsv, {query_ref}) AS rank, id
+              FROM articles_archive WHERE title_tsv @@ {query_ref} {window}"""
+        params += window_params
+    return sql, params
+
+
+def search_articles(c, keywords, limit=500, since=None, fetched_after=None):
+    query_sql, query_params = _articles_tsquery(keywords)
+    hits_sql, hits_params = _search_hits_sql("q.query", since, fetched_after)
+    c.execute(f"""SELECT source, title, link, summary, published, category, perspective, cluster_id, id
+                  FROM (SELECT {query_sql}) AS q(query), LATERAL ({hits_sql}) AS hits
+                  ORDER BY rank DESC, id DESC
+                  LIMIT %s""", query_params + hits_params + [limit])
+    return [dict(r) for r in c.fetchall()]
+
+
+def search_articles_batch(c, topics, limit=500, since=None):
+    # Più temi in un'unica query: una riga VALUES per tema, ricerca LATERAL con il suo LIMIT
+    values, params = [], []
+    for i, keywords in enumerate(topics):
+        query_sql, query_params = _articles_tsquery(keywords)
+        values.append(f"(%s, {query_sql})")
+        params += [i] + query_params
+    hits_sql, hits_params = _search_hits_sql("t.query", since)
+    c.execute(f"""SELECT t.topic, hits.*
+                  FROM (VALUES {', '.join(values)}) AS t(topic, query)
+                  CROSS JOIN LATERAL (
+                      SELECT * FROM ({hits_sql}) AS u
+                      ORDER BY rank DESC, id DESC
+                      LIMIT %s
+                  ) AS hits
+                  ORDER BY t.topic, hits.rank DESC, hits.id DESC""", params + hits_params + [limit])
+    found = [[] for _ in topics]
+    for r in c.fetchall():
+        r = dict(r)
+        del r["rank"]
+        found[r.pop("topic")].append(r)
+    return found
+
+
+MAX_WINDOW_HOURS = 24 * 365 * 50
+
+
+def parse_time_window(hours=None, since=None):
+    # hours: ultime N ore; since: timestamp ISO (senza fuso = UTC). Ritorna l'inizio della finestra
+    if since:
+        start = datetime.fromisoformat(str(since).replace("Z", "+00:00"))
+        return start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    if hours not in (None, ""):
+        hours = float(hours)
+        # inf, nan o valori enormi farebbero esplodere timedelta (OverflowError → 500)
+        if not math.isfinite(hours) or not 0 <= hours <= MAX_WINDOW_HOURS:
+            raise ValueError("hours fuori intervallo")
+        return datetime.now(timezone.utc) - timedelta(hours=hours) if hours else None
+    return None
+
+
+def find_previous_analyses(c, keywords, limit=2):
+    query_sql = " || ".join("plainto_tsquery('simple', %s)" for _ in keywords)
+    c.execute(f"""SELECT narrative_map, created_at FROM analyses
+                  WHERE keywords_tsv @@ ({query_sql})
+                  ORDER BY created_at DESC LIMIT %s""", list(keywords) + [limit])
+    return [dict(r) for r in c.fetchall()]
+
+
+def find_previous_analyses_batch(c, topics, limit=2):
+    # Storico di più temi in un'unica query, con lo schema VALUES + LATERAL di search_articles_batch
+    values, params = [], []
+    for i, keywords in enumerate(topics):
+        values.append("(%s, " + " || ".join("plainto_tsquery('simple', %s)" for _ in keywords) + ")")
+        params += [i] + list(keywords)
+    c.execute(f"""SELECT t.topic, a.narrative_map, a.created_at
+                  FROM (VALUES {', '.join(values)}) AS t(topic, query)
+                  CROSS JOIN LATERAL (
+                      SELECT narrative_map, created_at FROM analyses
+                      WHERE keywords_tsv @@ t.query
+                      ORDER BY created_at DESC LIMIT %s
+                  ) AS a
+                  ORDER BY t.topic, a.created_at DESC""", params + [limit])
+    found = [[] for _ in topics]
+    for r in c.fetchall():
+        r = dict(r)
+        found[r.pop("topic")].append(r)
+    return found
+
+
+def find_base_analysis(c, keywords, base_id=None):
+    # Analisi da aggiornare: quella indicata, altrimenti la più recente con le stesse
+    # keyword (in qualunque ordine, come le catene dello storico)
+    columns = """id, keywords, created_at, article_links, articles_until,
+                 narrative_map, convergences, divergences, legal, thread"""
+    if base_id is not None:
+        c.execute(f"SELECT {columns} FROM analyses WHERE id = %s", (base_id,))
+        row = c.fetchone()
+        return dict(row) if row else None
+    query_sql = " || ".join("plainto_tsquery('simple', %s)" for _ in keywords)
+    c.execute(f"""SELECT {columns} FROM analyses
+                  WHERE keywords_tsv @@ ({query_sql})
+                  ORDER BY created_at DESC LIMIT 20""", list(keywords))
+    wanted = sorted(keywords)
+    for row in c.fetchall():
+        if sorted(k.strip().lower() for k in row["keywords"].split(",") if k.strip()) == wanted:
+            return dict(row)
+    return None
 
 
-def save_analysis(keywords, article_count, narrative_map, convergences, divergences, legal, thread, instagram_script):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO analyses (keywords, article_count, narrative_map, convergences, divergences, legal, thread, instagram_script, created_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, (keywords, article_count, narrative_map, convergences, divergences, legal, thread, instagram_script,
-          datetime.now(timezone.utc).isoformat()))
-    conn.commit()
-    conn.close()
+# ─────────────────────────────────────────────
+# STATISTICHE — contatori incrementali + snapshot in memoria versionato
+# ─────────────────────────────────────────────
+STATS_TTL = float(os.environ.get("STATS_TTL", 30))
+
+_stats_lock = threading.Lock()
+_stats_cache = {"version": None, "data": None, "checked": 0.0}
+
+
+def bump_stats(c, pairs, last_update, sign=1):
+    # pairs: (category, source) delle righe inserite (sign=1) o rimosse (sign=-1)
+    counts = defaultdict(int)
+    for category, source in pairs:
+        counts[(category or "", source or "")] += sign
+    execute_values(c, """
+        INSERT INTO article_stats (category, source, n) VALUES %s
+        ON CONFLICT (category, source) DO UPDATE SET n = article_stats.n + EXCLUDED.n
+    """, [(cat, src, n) for (cat, src), n in counts.items()])
+    c.execute("""UPDATE stats_meta SET version = version + 1,
+                 last_update = GREATEST(last_update, %s) WHERE id = 1""", (last_update,))
+
+
+def invalidate_stats():
+    with _stats_lock:
+        _stats_cache["checked"] = 0.0
+
+
+def get_stats():
+    # Entro STATS_TTL serve la copia in memoria; poi verifica solo la versione (1 riga)
+    # e ricarica i contatori se un ciclo di ingestione l'ha cambiata
+    with _stats_lock:
+        if _stats_cache["data"] and time.monotonic() - _stats_cache["checked"] < STATS_TTL:
+            return _stats_cache["version"], _stats_cache["data"]
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT version, last_update, archived FROM stats_meta WHERE id = 1")
+        version, last_update, archived = c.fetchone()
+        data = _stats_cache["data"]
+        if version != _stats_cache["version"] or data is None:
+            c.execute("SELECT category, source, n FROM article_stats WHERE n > 0")
+            by_cat = defaultdict(int)
+            by_source = defaultdict(int)
+            for category, source, n in c.fetchall():
+                by_cat[category] += n
+                by_source[source] += n
+            data = {
+                "total": sum(by_cat.values()),
+                "archived": archived,
+                "by_category": dict(sorted(by_cat.items(), key=lambda kv: -kv[1])),
+                "by_source": dict(sorted(by_source.items(), key=lambda kv: -kv[1])),
+                "last_update": _isoformat(last_update),
+                "version": version,
+            }
+    with _stats_lock:
+        _stats_cache.update(version=version, data=data, checked=time.monotonic())
+    return version, data
+
+
+# ─────────────────────────────────────────────
+# ARCHIVIO — split caldo/freddo e retention
+# ─────────────────────────────────────────────
+ARCHIVE_LOCK = 7303  # chiave advisory: una sola compattazione alla volta
+
+
+def hot_horizon():
+    return datetime.now(timezone.utc) - timedelta(days=ARTICLES_HOT_DAYS)
+
+
+def compact_articles():
+    # Sposta a blocchi gli articoli oltre l'orizzonte caldo in articles_archive, togliendoli
+    # dai contatori di /api/stats; poi applica la retention dell'archivio.
+    # Non si partiziona per mese: UNIQUE(link), su cui si basa la deduplica dell'ingestione,
+    # non è applicabile a una tabella partizionata per data
+    moved_total = 0
+    purged = 0
+    while True:
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("SELECT pg_try_advisory_xact_lock(%s)", (ARCHIVE_LOCK,))
+            if not c.fetchone()[0]:
+                print("[ARCHIVE] compattazione già in corso altrove.")
+                return 0
+            c.execute("""
+                WITH moved AS (
+                    DELETE FROM articles WHERE id IN (
+                        SELECT id FROM articles WHERE fetched_at < %s ORDER BY fetched_at, id LIMIT %s
+                    )
+                    RETURNING id, source, title, link, published, fetched_at, category, perspective, cluster_id
+                ), archived AS (
+                    INSERT INTO articles_archive (id, source, title, link, published, fetched_at,
+                                                  category, perspective, cluster_id)
+                    SELECT id, source, title, link, published, fetched_at, category, perspective, cluster_id
+                    FROM moved
+                    ON CONFLICT (link) DO NOTHING
+                )
+                SELECT category, source FROM moved
+            """, (hot_horizon(), ARCHIVE_BATCH))
+            moved = c.fetchall()
+            if moved:
+                bump_stats(c, moved, None, sign=-1)
+                c.execute("UPDATE stats_meta SET archived = archived + %s WHERE id = 1", (len(moved),))
+            if len(moved) < ARCHIVE_BATCH and ARCHIVE_RETENTION_DAYS:
+                c.execute("DELETE FROM articles_archive WHERE fetched_at < now() - make_interval(days => %s)",
+                          (ARCHIVE_RETENTION_DAYS,))
+                purged = c.rowcount
+                if purged:
+                    c.execute("UPDATE stats_meta SET archived = GREATEST(archived - %s, 0), version = version + 1 "
+                              "WHERE id = 1", (purged,))
+        moved_total += len(moved)
+        if len(moved) < ARCHIVE_BATCH:
+            break
+    if moved_total or purged:
+        invalidate_stats()
+        invalidate_responses()
+        print(f"[ARCHIVE] {moved_total} articoli archiviati, {purged} eliminati dall'archivio.")
+    return moved_total
+
+
+# ─────────────────────────────────────────────
+# CACHE RISPOSTE — endpoint pubblici, invalidata dall'ingestione
+# ─────────────────────────────────────────────
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 300))
+
+_response_cache_lock = threading.Lock()
+_response_cache = OrderedDict()
+_response_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+
+def invalidate_responses():
+    with _response_cache_lock:
+        _response_cache.clear()
+        _response_cache_stats["invalidations"] += 1
+
+
+def response_cache_stats():
+    with _response_cache_lock:
+        return {**_response_cache_stats, "size": len(_response_cache), "max_size": RESPONSE_CACHE_SIZE}
+
+
+# Compressione negoziata su Accept-Encoding (brotli se installato, altrimenti gzip) per
+# le risposte testuali sopra COMPRESS_MIN_BYTES; SSE e risposte in streaming escluse
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 500))
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/plain", "text/css", "application/javascript"}
+
+
+def _negotiate_encoding():
+    return request.accept_encodings.best_match(["br", "gzip"] if brotli else ["gzip"])
+
+
+def _encode(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=5)
+
+
+def _set_encoded(response, body, encoding):
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+
+
+@app.after_request
+def _compress_response(response):
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or "Content-Encoding" in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    encoding = _negotiate_encoding()
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        _set_encoded(response, _encode(body, encoding), encoding)
+    return response
+
+
+def cached_response(max_age=60, version=None):
+    # Chiave: route + query args. Una voce vale finché la versione dei dati (stats_meta,
+    # condivisa fra i worker) non cambia e non supera RESPONSE_CACHE_TTL.
+    # version: versione fissa per le route che non leggono il DB (nessuna chiamata a get_stats)
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            current = version if version is not None else get_stats()[0]
+            now = time.monotonic()
+            with _response_cache_lock:
+                entry = _response_cache.get(key)
+                if entry and entry["version"] == current and now - entry["created"] < RESPONSE_CACHE_TTL:
+                    _response_cache.move_to_end(key)
+                    _response_cache_stats["hits"] += 1
+                else:
+                    entry = None
+                    _response_cache_stats["misses"] += 1
+            if entry is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = {
+                    "version": current, "created": now, "body": body, "encoded": {},
+                    "mimetype": response.mimetype,
+                    "headers": [(k, v) for k, v in response.headers.items() if k.startswith("X-")],
+                    "etag": hashlib.sha1(body).hexdigest(),
+                }
+                with _response_cache_lock:
+                    _response_cache[key] = entry
+                    _response_cache.move_to_end(key)
+                    while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                        _response_cache.popitem(last=False)
+                        _response_cache_stats["evictions"] += 1
+            response = app.response_class(entry["body"], mimetype=entry["mimetype"])
+            for k, v in entry["headers"]:
+                response.headers[k] = v
+            # Ogni codifica è una rappresentazione diversa: ETag forte distinto per variante,
+            # altrimenti un proxy potrebbe rispondere 304 a chi chiede identity con il gzip in cache
+            encoding = _negotiate_encoding() if len(entry["body"]) >= COMPRESS_MIN_BYTES else None
+            response.set_etag(f"{entry['etag']}-{encoding}" if encoding else entry["etag"])
+            response.vary.add("Accept-Encoding")
+            response.headers["Cache-Control"] = f"public, max-age={max_age}"
+            response = response.make_conditional(request)
+            # La versione compressa si calcola una volta per voce, non a ogni hit
+            if response.status_code == 200 and encoding:
+                if encoding not in entry["encoded"]:
+                    entry["encoded"][encoding] = _encode(entry["body"], encoding)
+                _set_encoded(response, entry["encoded"][encoding], encoding)
+            return response
+        return wrapper
+    return decorator
 
 
 # ─────────────────────────────────────────────
@@ -224,86 +1116,1234 @@ CATEGORY_TAGS = {
 }
 
 
+OTHER_CATEGORY = "⚪ Altro"
+
+# Chiavi ambigue: solo a parola intera (plurale in -s ammesso), altrimenti "eu" scatta
+# dentro "europe", "ue" dentro "questione", "mali" dentro "malinconia".
+# Le altre si cercano come sottostringhe, come prima: "war" → "postwar", "attack" →
+# "counterattack", "offensiva" → "controffensiva".
+WHOLE_WORD_KEYS = {"eu", "ue", "mali", "coup", "g7", "g20"}
+
+
+def _is_whole_word(key):
+    return key in WHOLE_WORD_KEYS
+
+
+def _build_matcher():
+    categories = [cat for cat in CATEGORY_TAGS if cat != OTHER_CATEGORY]
+    terms = sorted(ALL_KEYWORDS.union(*CATEGORY_TAGS.values()))
+    # Per ogni termine: è rilevante? a quale categoria appartiene?
+    info = {}
+    for term in terms:
+        cats = [i for i, cat in enumerate(categories) if term in CATEGORY_TAGS[cat]]
+        info[term] = (term in ALL_KEYWORDS, min(cats) if cats else None)
+    # Le chiavi di più parole ("middle east", "indo-pacific") si cercano sul testo intero,
+    # tutte le altre dentro le singole parole
+    phrases = [t for t in terms if not re.fullmatch(r"\w+", t)]
+    words = [t for t in terms if t not in phrases]
+    return info, categories, phrases, words
+
+
+_MATCHER_INFO, _MATCHER_CATEGORIES, _MATCHER_PHRASES, _MATCHER_WORDS = _build_matcher()
+_WORD_RE = re.compile(r"\w+")
+_WORD_CACHE_MAX = 50_000
+_word_cache = {}
+
+
+def _word_terms(word):
+    # Termini contenuti in una parola. Le parole dei titoli si ripetono molto: match_entry
+    # consulta prima _word_cache, svuotata oltre _WORD_CACHE_MAX voci
+    terms = tuple(k for k in _MATCHER_WORDS
+                  if (word in (k, k + "s") if _is_whole_word(k) else k in word))
+    if len(_word_cache) >= _WORD_CACHE_MAX:
+        _word_cache.clear()
+    _word_cache[word] = terms
+    return terms
+
+
+def match_entry(text):
+    # Singola passata sulle parole: (rilevante, categoria vincente, termini trovati)
+    text = text.lower()
+    matched = {}
+    for word in _WORD_RE.findall(text):
+        terms = _word_cache.get(word)
+        if terms is None:
+            terms = _word_terms(word)
+        if terms:
+            matched.update(dict.fromkeys(terms))
+    for term in _MATCHER_PHRASES:
+        if term in text:
+            matched[term] = None
+    relevant = False
+    best = None
+    for term in matched:
+        term_relevant, cat = _MATCHER_INFO[term]
+        relevant = relevant or term_relevant
+        if cat is not None and (best is None or cat < best):
+            best = cat
+    category = _MATCHER_CATEGORIES[best] if best is not None else OTHER_CATEGORY
+    return relevant, category, list(matched)
+
+
 def categorize(text):
-    text_lower = text.lower()
-    for cat, keys in CATEGORY_TAGS.items():
-        if cat == "⚪ Altro":
-            continue
-        for k in keys:
-            if k in text_lower:
-                return cat
-    return "⚪ Altro"
+    return match_entry(text)[1]
 
 
 def is_relevant(title, summary=""):
-    text = (title + " " + summary).lower()
-    return any(kw in text for kw in ALL_KEYWORDS)
+    return match_entry(title + " " + summary)[0]
+
+
+# ─────────────────────────────────────────────
+# CLUSTERING — MinHash + LSH per le storie quasi identiche fra testate
+# ─────────────────────────────────────────────
+MINHASH_BANDS = 8
+MINHASH_ROWS = 4
+MINHASH_SIZE = MINHASH_BANDS * MINHASH_ROWS
+CLUSTER_THRESHOLD = float(os.environ.get("CLUSTER_THRESHOLD", 0.5))
+CLUSTER_WINDOW_HOURS = int(os.environ.get("CLUSTER_WINDOW_HOURS", 72))
+
+# Hash multiply-add-shift (a·h + b mod 2^64) >> 32 sui crc32 delle shingle.
+# Seed fisso: le firme salvate nel DB restano confrontabili fra processi e riavvii
+_MASK64 = (1 << 64) - 1
+_minhash_rng = random.Random(1409)
+_MINHASH_PARAMS = [(_minhash_rng.randrange(1 << 64) | 1, _minhash_rng.randrange(1 << 64))
+                   for _ in range(MINHASH_SIZE)]
+_MINHASH_FORMAT = f"<{MINHASH_SIZE}I"
+_CLUSTER_STOPWORDS = {
+    "the", "and", "for", "with", "from", "that", "this", "are", "was", "has", "have", "after", "over",
+    "della", "delle", "dello", "degli", "dei", "del", "nel", "nella", "nei", "alla", "alle", "allo",
+    "agli", "sul", "sulla", "per", "con", "che", "non", "una", "uno", "gli", "dopo", "tra", "fra",
+}
+
+
+CLUSTER_SUMMARY_WORDS = 25
+
+
+def _words(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [w for w in re.findall(r"\w+", text) if len(w) > 2 and w not in _CLUSTER_STOPWORDS]
+
+
+def _cluster_shingles(title, summary):
+    # Il titolo pesa di più (parole + coppie di parole): i sommari hanno spesso frasi di rito
+    title_words = _words(title)
+    shingles = set(title_words)
+    shingles.update(f"{a} {b}" for a, b in zip(title_words, title_words[1:]))
+    shingles.update(_words(summary)[:CLUSTER_SUMMARY_WORDS])
+    return shingles
+
+
+def minhash_signature(title, summary=""):
+    shingles = _cluster_shingles(title or "", summary or "")
+    if not shingles:
+        return None
+    hashes = [zlib.crc32(s.encode()) for s in shingles]
+    # Lo shift è monotono: basta applicarlo al minimo
+    return tuple(min([(a * h + b) & _MASK64 for h in hashes]) >> 32 for a, b in _MINHASH_PARAMS)
+
+
+class ClusterIndex:
+    # Indice LSH in memoria: 8 bande da 4 righe, due firme con Jaccard ~0.5 collidono
+    # in almeno una banda con probabilità ~40%, con Jaccard ~0.8 quasi sempre
+    def __init__(self):
+        self.buckets = defaultdict(list)   # (banda, valori) → [id articolo]
+        self.entries = {}                  # id articolo → (cluster_id, firma)
+        self.order = deque()               # (fetched_at, id articolo) per la potatura
+
+    @staticmethod
+    def _band_keys(signature):
+        return [(b, signature[b * MINHASH_ROWS:(b + 1) * MINHASH_ROWS]) for b in range(MINHASH_BANDS)]
+
+    def add(self, article_id, cluster_id, signature, fetched_at):
+        self.entries[article_id] = (cluster_id, signature)
+        self.order.append((fetched_at, article_id))
+        for key in self._band_keys(signature):
+            self.buckets[key].append(article_id)
+
+    def match(self, signature):
+        best, best_score = None, CLUSTER_THRESHOLD
+        seen = set()
+        for key in self._band_keys(signature):
+            for article_id in self.buckets.get(key, ()):
+                if article_id in seen:
+                    continue
+                seen.add(article_id)
+                cluster_id, other = self.entries[article_id]
+                score = sum(x == y for x, y in zip(signature, other)) / MINHASH_SIZE
+                if score >= best_score:
+                    best, best_score = cluster_id, score
+        return best
+
+    def prune(self, cutoff):
+        while self.order and self.order[0][0] < cutoff:
+            _, article_id = self.order.popleft()
+            _, signature = self.entries.pop(article_id)
+            for key in self._band_keys(signature):
+                bucket = self.buckets[key]
+                bucket.remove(article_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+_cluster_lock = threading.Lock()
+_cluster_index = None
+
+
+def _load_cluster_index(c):
+    # Le firme sono persistite in articles.minhash: al primo uso si ricostruisce la finestra recente
+    index = ClusterIndex()
+    c.execute("""SELECT id, cluster_id, minhash, fetched_at FROM articles
+                 WHERE minhash IS NOT NULL AND fetched_at > now() - make_interval(hours => %s)
+                 ORDER BY fetched_at, id""", (CLUSTER_WINDOW_HOURS,))
+    for article_id, cluster_id, minhash, fetched_at in c.fetchall():
+        index.add(article_id, cluster_id or article_id, struct.unpack(_MINHASH_FORMAT, minhash), fetched_at)
+    print(f"[CLUSTER] indice caricato: {len(index)} firme")
+    return index
+
+
+def assign_clusters(c, articles, now):
+    # articles: (id, titolo, sommario) appena inseriti; ritorna (id, cluster_id, firma) da salvare
+    global _cluster_index
+    with _cluster_lock:
+        if _cluster_index is None:
+            _cluster_index = _load_cluster_index(c)
+        index = _cluster_index
+        index.prune(now - timedelta(hours=CLUSTER_WINDOW_HOURS))
+        out = []
+        for article_id, title, summary in articles:
+            signature = minhash_signature(title, summary)
+            if signature is None:
+                out.append((article_id, article_id, None))
+                continue
+            cluster_id = index.match(signature) or article_id
+            index.add(article_id, cluster_id, signature, now)
+            out.append((article_id, cluster_id, struct.pack(_MINHASH_FORMAT, *signature)))
+        return out
+
+
+def reset_cluster_index():
+    # Dopo un rollback l'indice contiene id mai salvati: lo si ricarica dal DB al prossimo uso
+    global _cluster_index
+    with _cluster_lock:
+        _cluster_index = None
+
+
+# ─────────────────────────────────────────────
+# RILEVANZA — indice TF-IDF in memoria per ordinare i candidati delle analisi
+# ─────────────────────────────────────────────
+# Feature hashing (crc32 → 2^20 colonne): nessun vocabolario da mantenere, l'indice cresce
+# solo per righe. Le righe tengono il tf sublineare (1 + log tf); l'idf si applica alla query,
+# così i documenti nuovi non invalidano quelli già indicizzati
+TFIDF_DIM = 1 << 20
+TFIDF_DIR = os.environ.get("TFIDF_DIR", os.path.join(tempfile.gettempdir(), "theatrum-tfidf"))
+TFIDF_REFRESH_SECONDS = float(os.environ.get("TFIDF_REFRESH_SECONDS", 30))
+TFIDF_SNAPSHOT_EVERY = int(os.environ.get("TFIDF_SNAPSHOT_EVERY", 2000))  # documenti nuovi fra due snapshot
+TFIDF_MAX_CHUNKS = 8
+TFIDF_BATCH = 5000
+TFIDF_KEEP_SNAPSHOTS = 3
+TFIDF_TITLE_WEIGHT = 2
+
+
+def _tfidf_terms(text, repeat=1):
+    return [zlib.crc32(w.encode()) & (TFIDF_DIM - 1) for w in _words(text or "")] * repeat
+
+
+def tfidf_rows(docs):
+    # docs: (titolo, sommario) → matrice CSR, una riga per documento
+    indptr, indices, data = [0], [], []
+    for title, summary in docs:
+        counts = Counter(_tfidf_terms(title, TFIDF_TITLE_WEIGHT) + _tfidf_terms(summary))
+        indices.extend(counts.keys())
+        data.extend(1.0 + math.log(n) for n in counts.values())
+        indptr.append(len(indices))
+    rows = sp.csr_matrix((np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32),
+                          np.asarray(indptr, dtype=np.int64)), shape=(len(docs), TFIDF_DIM))
+    rows.sort_indices()
+    return rows
+
+
+class RelevanceIndex:
+    # Blocchi (id crescenti, righe CSR): il primo può arrivare in mmap dallo snapshot,
+    # i successivi sono i delta dell'ingestione, fusi quando diventano troppi
+    def __init__(self, chunks=(), df=None, last_id=0):
+        self.chunks = list(chunks)
+        self.df = df if df is not None else np.zeros(TFIDF_DIM, dtype=np.int32)
+        self.last_id = last_id
+        self.unsaved = 0
+
+    def copy(self):
+        # Blocchi condivisi (non vengono mai modificati sul posto), df copiato
+        index = RelevanceIndex(self.chunks, self.df.copy(), self.last_id)
+        index.unsaved = self.unsaved
+        return index
+
+    def add(self, ids, docs):
+        if not ids:
+            return
+        rows = tfidf_rows(docs)
+        self.chunks.append((np.asarray(ids, dtype=np.int64), rows))
+        self.df += np.bincount(rows.indices, minlength=TFIDF_DIM).astype(np.int32)
+        self.last_id = max(self.last_id, int(max(ids)))
+        self.unsaved += len(ids)
+        if len(self.chunks) > TFIDF_MAX_CHUNKS:
+            self.merge()
+
+    def drop_before(self, min_id):
+        # Retention dell'archivio: gli id crescono con fetched_at, quindi gli articoli
+        # eliminati sono un prefisso. Le righe escono dai blocchi e dal df
+        kept = []
+        removed = 0
+        for ids, rows in self.chunks:
+            start = int(np.searchsorted(ids, min_id))
+            if start:
+                self.df -= np.bincount(rows[:start].indices, minlength=TFIDF_DIM).astype(np.int32)
+                removed += start
+                ids, rows = ids[start:], rows[start:]
+            if len(ids):
+                kept.append((ids, rows))
+        self.chunks = kept
+        self.unsaved += removed
+        return removed
+
+    def merge(self):
+        if len(self.chunks) > 1:
+            self.chunks = [(np.concatenate([ids for ids, _ in self.chunks]),
+                            sp.vstack([rows for _, rows in self.chunks], format="csr"))]
+
+    def score(self, keywords, ids):
+        # Coseno tf-idf fra le keyword e ogni candidato, in un solo passaggio vettoriale
+        # per blocco; 0 per i candidati non (ancora) indicizzati
+        ids = np.asarray(ids, dtype=np.int64)
+        scores = np.zeros(len(ids))
+        terms = np.unique(np.asarray([t for kw in keywords for t in _tfidf_terms(kw)], dtype=np.int64))
+        if not len(terms) or not len(ids):
+            return scores
+        n_docs = len(self)
+        query = np.log((1 + n_docs) / (1 + self.df[terms])) + 1.0
+        for chunk_ids, rows in self.chunks:
+            pos = np.minimum(np.searchsorted(chunk_ids, ids), len(chunk_ids) - 1)
+            hit = chunk_ids[pos] == ids
+            if not hit.any():
+                continue
+            sub = rows[pos[hit]]
+            weights = sub.data * (np.log((1 + n_docs) / (1 + self.df[sub.indices])) + 1.0)
+            sub = sp.csr_matrix((weights, sub.indices, sub.indptr), shape=sub.shape)
+            norms = np.sqrt(np.asarray(sub.multiply(sub).sum(axis=1)).ravel())
+            dots = sub[:, terms] @ query
+            scores[hit] = dots / np.maximum(norms, 1e-9) / np.linalg.norm(query)
+        return scores
+
+    def save(self, directory):
+        # Ogni snapshot ha la sua cartella, scritta sotto un nome temporaneo e rinominata
+        # quando è completa; poi si sostituisce il puntatore "current". Gli snapshot
+        # precedenti restano (gli ultimi TFIDF_KEEP_SNAPSHOTS) per gli altri processi che
+        # li hanno in mmap o li stanno caricando
+        self.merge()
+        if not self.chunks:
+            return
+        ids, rows = self.chunks[0]
+        os.makedirs(directory, exist_ok=True)
+        version = f"v{time.time_ns()}-{os.getpid()}"
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=directory)
+        try:
+            arrays = {"ids": ids, "data": rows.data, "indices": rows.indices, "indptr": rows.indptr, "df": self.df}
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), array)
+            with open(os.path.join(tmp, "meta.json"), "w") as f:
+                json.dump({"last_id": self.last_id, "dim": TFIDF_DIM, "docs": len(ids)}, f)
+            os.rename(tmp, os.path.join(directory, version))
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        pointer = os.path.join(directory, f".current.{os.getpid()}")
+        with open(pointer, "w") as f:
+            f.write(version)
+        os.replace(pointer, os.path.join(directory, "current"))
+        self.unsaved = 0
+        versions = sorted(name for name in os.listdir(directory) if name.startswith("v"))
+        for name in versions[:-TFIDF_KEEP_SNAPSHOTS]:
+            if name != version:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "current")) as f:
+            snapshot = os.path.join(directory, f.read().strip())
+        with open(os.path.join(snapshot, "meta.json")) as f:
+            meta = json.load(f)
+        if meta["dim"] != TFIDF_DIM:
+            raise ValueError(f"snapshot con dimensione {meta['dim']}")
+
+        def path(name):
+            return os.path.join(snapshot, f"{name}.npy")
+        ids = np.load(path("ids"), mmap_mode="r")
+        rows = sp.csr_matrix((np.load(path("data"), mmap_mode="r"), np.load(path("indices"), mmap_mode="r"),
+                              np.load(path("indptr"), mmap_mode="r")), shape=(len(ids), TFIDF_DIM), copy=False)
+        return cls([(ids, rows)], np.load(path("df")), meta["last_id"])
+
+    def __len__(self):
+        return sum(len(ids) for ids, _ in self.chunks)
+
+
+_tfidf_lock = threading.Lock()
+_tfidf = {"index": None, "checked": None, "busy": False}
+
+
+def _tfidf_catch_up(index):
+    # Articoli nuovi per id crescente; al primo avvio anche quelli già passati in archivio.
+    # La compattazione sposta gli articoli senza cambiarne l'id; quelli eliminati dalla
+    # retention sono sotto il primo id ancora presente nelle due tabelle
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT LEAST((SELECT min(id) FROM articles), (SELECT min(id) FROM articles_archive))")
+        min_id = c.fetchone()[0]
+        index.drop_before(min_id if min_id is not None else index.last_id + 1)
+        while True:
+            c.execute("""SELECT id, title, summary FROM articles WHERE id > %s
+                         UNION ALL
+                         SELECT id, title, '' FROM articles_archive WHERE id > %s
+                         ORDER BY id LIMIT %s""", (index.last_id, index.last_id, TFIDF_BATCH))
+            rows = c.fetchall()
+            index.add([r[0] for r in rows], [(r[1], r[2]) for r in rows])
+            if len(rows) < TFIDF_BATCH:
+                break
+    if index.unsaved >= TFIDF_SNAPSHOT_EVERY:
+        try:
+            index.save(TFIDF_DIR)
+        except OSError as e:
+            print(f"[TFIDF] snapshot non salvato: {e}")
+
+
+def _tfidf_refresh(index):
+    # In background su una copia: DB, calcolo delle righe e snapshot avvengono fuori dal
+    # lock, che serve solo a pubblicare il nuovo indice. Quello vecchio non viene toccato
+    # e le richieste in corso continuano a usarlo
+    try:
+        if index is None:
+            try:
+                index = RelevanceIndex.load(TFIDF_DIR)
+                print(f"[TFIDF] snapshot caricato: {len(index)} documenti")
+            except (OSError, ValueError, KeyError):
+                index = RelevanceIndex()
+            _tfidf_catch_up(index)
+            print(f"[TFIDF] indice pronto: {len(index)} documenti (ultimo id {index.last_id})")
+        else:
+            index = index.copy()
+            _tfidf_catch_up(index)
+        with _tfidf_lock:
+            _tfidf["index"] = index
+    except Exception as e:
+        print(f"[TFIDF] aggiornamento fallito: {e}")
+    finally:
+        with _tfidf_lock:
+            _tfidf.update(checked=time.monotonic(), busy=False)
+
+
+def relevance_index():
+    # Ogni processo web tiene il suo indice e lo aggiorna in modo pigro: al più ogni
+    # TFIDF_REFRESH_SECONDS una richiesta avvia il recupero degli articoli nuovi in un thread
+    # e intanto usa l'ultimo indice pubblicato (al primo avvio nessuno: resta l'ordine
+    # ts_rank di Postgres). L'ingestione gira in un altro processo e non lo tocca
+    with _tfidf_lock:
+        index = _tfidf["index"]
+        checked = _tfidf["checked"]
+        if not _tfidf["busy"] and (checked is None or time.monotonic() - checked > TFIDF_REFRESH_SECONDS):
+            _tfidf["busy"] = True
+            threading.Thread(target=_tfidf_refresh, args=(index,), daemon=True).start()
+    return index
+
+
+def rank_by_relevance(keywords, articles):
+    # Candidati ordinati per coseno tf-idf; a parità di punteggio resta l'ordine di ingresso.
+    # Un indice pubblicato non cambia più: nessun lock per il punteggio
+    index = relevance_index()
+    if index is None or not articles:
+        return articles
+    scores = index.score(keywords, [a["id"] for a in articles])
+    return [articles[i] for i in np.argsort(-scores, kind="stable")]
+
+
+# ─────────────────────────────────────────────
+# TREND — termini in accelerazione per prospettiva (sketch orari)
+# ─────────────────────────────────────────────
+# Ogni ora di ingestione ha una riga in trend_buckets: count-min sketch dei termini e delle
+# coppie prospettiva|termine (un conteggio per articolo), top-K Space-Saving dei termini e
+# articoli per prospettiva. Tabella e memoria restano limitate a prescindere dall'archivio
+# e /api/trends non legge mai articles
+TREND_WINDOW_HOURS = int(os.environ.get("TREND_WINDOW_HOURS", 6))
+TREND_BASELINE_HOURS = int(os.environ.get("TREND_BASELINE_HOURS", 168))
+TREND_MIN_COUNT = int(os.environ.get("TREND_MIN_COUNT", 3))
+TREND_SKETCH_DEPTH = 4
+TREND_SKETCH_WIDTH = 4096  # potenza di 2
+TREND_TOP_K = 300
+TREND_REFRESH_SECONDS = 60
+TREND_ENTITY_WORDS = 3
+
+_SKETCH_ROWS = np.arange(TREND_SKETCH_DEPTH)
+# crc32 con seed diversi differisce solo per una costante (è affine): le righe sarebbero
+# correlate. Come per MinHash, multiply-add-shift indipendenti sopra un solo crc32
+_sketch_rng = random.Random(2203)
+_SKETCH_PARAMS = [(_sketch_rng.randrange(1 << 64) | 1, _sketch_rng.randrange(1 << 64))
+                  for _ in range(TREND_SKETCH_DEPTH)]
+_SKETCH_SHIFT = 64 - (TREND_SKETCH_WIDTH.bit_length() - 1)
+_CAPITALIZED_RE = re.compile(r"[A-ZÀ-Ý][\w'’-]*")
+
+
+def trend_terms(title):
+    # Parole del titolo + entità (2-3 parole maiuscole consecutive, es. "Donald Trump").
+    # Nei titoli in Title Case (nessuna parola lunga minuscola) le maiuscole non dicono nulla
+    title = title or ""
+    terms = set(_words(title))
+    tokens = title.split()
+    if not any(len(t) > 3 and t[0].islower() for t in tokens):
+        return terms
+    run = []
+    for token in tokens + [""]:
+        word = token.rstrip(".,:;!?»\"'’)")
+        if word and _CAPITALIZED_RE.fullmatch(word):
+            run.append(word)
+            if word == token:
+                continue
+        if 2 <= len(run) <= TREND_ENTITY_WORDS:
+            entity = " ".join(w for t in run for w in _words(t))
+            if " " in entity:
+                terms.add(entity)
+        run = []
+    return terms
+
+
+def _sketch_cells(keys):
+    # (n, profondità): colonna dello sketch di ogni chiave in ogni riga
+    hashes = [zlib.crc32(k.encode()) for k in keys]
+    return np.array([[((a * h + b) & _MASK64) >> _SKETCH_SHIFT for a, b in _SKETCH_PARAMS]
+                     for h in hashes], dtype=np.int64).reshape(-1, TREND_SKETCH_DEPTH)
+
+
+class TrendBucket:
+    def __init__(self, sketch=None, heavy=None, docs=None):
+        self.sketch = sketch if sketch is not None else np.zeros(
+            (TREND_SKETCH_DEPTH, TREND_SKETCH_WIDTH), dtype=np.int32)
+        self.heavy = heavy or {}   # termine → [conteggio, errore massimo]
+        self.docs = docs or {}     # prospettiva → articoli
+
+    @classmethod
+    def from_row(cls, sketch, heavy, docs):
+        array = np.frombuffer(bytes(sketch), dtype=np.int32).reshape(TREND_SKETCH_DEPTH, TREND_SKETCH_WIDTH)
+        return cls(array.copy(), heavy, docs)
+
+    def add(self, terms, perspective):
+        self.docs[perspective] = self.docs.get(perspective, 0) + 1
+        terms = sorted(terms)
+        if not terms:
+            return
+        cells = _sketch_cells(terms + [f"{perspective}|{t}" for t in terms])
+        for row in cells:
+            # Aggiornamento conservativo: si alzano solo le celle al minimo
+            current = self.sketch[_SKETCH_ROWS, row]
+            self.sketch[_SKETCH_ROWS, row] = np.maximum(current, current.min() + 1)
+        for term in terms:
+            self._offer(term)
+
+    def _offer(self, term):
+        # Space-Saving: il termine nuovo prende il posto del meno frequente, ereditandone il conteggio
+        if term in self.heavy:
+            self.heavy[term][0] += 1
+        elif len(self.heavy) < TREND_TOP_K:
+            self.heavy[term] = [1, 0]
+        else:
+            victim = min(self.heavy, key=lambda t: self.heavy[t][0])
+            count = self.heavy.pop(victim)[0]
+            self.heavy[term] = [count + 1, count]
+
+    def estimate(self, cells):
+        return self.sketch[_SKETCH_ROWS, cells].min(axis=1)
+
+
+def _trend_bucket_start(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def record_trends(c, articles, now):
+    # articles: (titolo, prospettiva) appena inseriti, in un savepoint della transazione di save_articles
+    if not articles:
+        return
+    bucket_at = _trend_bucket_start(now)
+    c.execute("SELECT sketch, heavy, docs FROM trend_buckets WHERE bucket = %s FOR UPDATE", (bucket_at,))
+    row = c.fetchone()
+    bucket = TrendBucket.from_row(*row) if row else TrendBucket()
+    for title, perspective in articles:
+        bucket.add(trend_terms(title), perspective or "other")
+    c.execute("""
+        INSERT INTO trend_buckets (bucket, sketch, heavy, docs) VALUES (%s, %s, %s, %s)
+        ON CONFLICT (bucket) DO UPDATE SET sketch = EXCLUDED.sketch, heavy = EXCLUDED.heavy,
+            docs = EXCLUDED.docs, updated_at = now()
+    """, (bucket_at, bucket.sketch.tobytes(), Json(bucket.heavy), Json(bucket.docs)))
+    c.execute("DELETE FROM trend_buckets WHERE bucket < %s",
+              (bucket_at - timedelta(hours=TREND_WINDOW_HOURS + TREND_BASELINE_HOURS),))
+
+
+# Stesso schema di metrics_window: le ore già lette restano in memoria, si rileggono
+# solo le righe aggiornate dopo l'ultimo controllo (con un margine per i commit tardivi)
+_trend_lock = threading.Lock()
+_trend_window = {"buckets": {}, "updated_at": None, "checked": 0.0}
+
+
+def trend_buckets():
+    with _trend_lock:
+        if time.monotonic() - _trend_window["checked"] >= TREND_REFRESH_SECONDS:
+            horizon = _trend_bucket_start(datetime.now(timezone.utc)) - timedelta(
+                hours=TREND_WINDOW_HOURS + TREND_BASELINE_HOURS)
+            since = _trend_window["updated_at"]
+            with db() as conn:
+                c = conn.cursor()
+                c.execute("""SELECT bucket, sketch, heavy, docs, updated_at FROM trend_buckets
+                             WHERE bucket >= %s AND updated_at > %s""",
+                          (horizon, since - timedelta(minutes=5) if since else horizon - timedelta(days=1)))
+                for bucket_at, sketch, heavy, docs, updated_at in c.fetchall():
+                    _trend_window["buckets"][bucket_at] = TrendBucket.from_row(sketch, heavy, docs)
+                    if not since or updated_at > since:
+                        since = updated_at
+            _trend_window["updated_at"] = since
+            for bucket_at in [b for b in _trend_window["buckets"] if b < horizon]:
+                del _trend_window["buckets"][bucket_at]
+            _trend_window["checked"] = time.monotonic()
+        return dict(_trend_window["buckets"])
+
+
+def compute_trends(window_hours=TREND_WINDOW_HOURS, baseline_hours=TREND_BASELINE_HOURS, limit=20):
+    # Accelerazione = (conteggio recente + 1) / (atteso dalla baseline + 1), con la baseline
+    # riscalata sulle ore effettivamente coperte dallo storico
+    buckets = trend_buckets()
+    window_start = _trend_bucket_start(datetime.now(timezone.utc)) - timedelta(hours=window_hours - 1)
+    baseline_start = window_start - timedelta(hours=baseline_hours)
+    recent = [b for t, b in buckets.items() if t >= window_start]
+    baseline = [(t, b) for t, b in buckets.items() if baseline_start <= t < window_start]
+
+    documents = defaultdict(int)
+    for b in recent:
+        for persp, n in b.docs.items():
+            documents[persp] += n
+    terms = sorted({term for b in recent for term in b.heavy})
+    result = {
+        "window_hours": window_hours,
+        "baseline_hours": baseline_hours,
+        "documents": {PERSPECTIVE_LABELS.get(p, p): n for p, n in sorted(documents.items())},
+        "trends": [],
+    }
+    if not terms:
+        return result
+
+    cells = _sketch_cells(terms)
+    counts = sum(b.estimate(cells) for b in recent)
+    expected = np.zeros(len(terms))
+    if baseline:
+        covered_hours = (window_start - min(t for t, _ in baseline)).total_seconds() / 3600
+        expected = sum(b.estimate(cells) for _, b in baseline) * window_hours / max(covered_hours, 1.0)
+    ratios = (counts + 1) / (expected + 1)
+    ranked = [i for i in np.lexsort((-counts, -ratios))
+              if counts[i] >= TREND_MIN_COUNT and ratios[i] > 1][:limit]
+    if not ranked:
+        return result
+
+    perspectives = list(PERSPECTIVE_LABELS)
+    top = [terms[i] for i in ranked]
+    by_perspective = {p: sum(b.estimate(_sketch_cells([f"{p}|{t}" for t in top])) for b in recent)
+                      for p in perspectives}
+    for j, i in enumerate(ranked):
+        coverage = {p: int(by_perspective[p][j]) for p in perspectives if by_perspective[p][j] > 0}
+        result["trends"].append({
+            "term": terms[i],
+            "count": int(counts[i]),
+            "expected": round(float(expected[i]), 2),
+            "ratio": round(float(ratios[i]), 2),
+            "perspectives": {PERSPECTIVE_LABELS[p]: n for p, n in coverage.items()},
+            "covered_by": [PERSPECTIVE_LABELS[p] for p in coverage],
+            # Prospettive che nella finestra hanno pubblicato, ma non su questo termine
+            "ignored_by": [PERSPECTIVE_LABELS[p] for p in perspectives
+                           if p not in coverage and documents.get(p)],
+        })
+    return result
 
 
 # ─────────────────────────────────────────────
 # FETCH RSS
 # ─────────────────────────────────────────────
-def fetch_all():
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] Fetching feeds...")
-    count = 0
-    for source, (url, perspective) in FEEDS.items():
+# Timeout dedicati per gli host lenti: non devono trattenere l'intero ciclo
+HOST_TIMEOUTS = {
+    "feeds.reuters.com": 8,
+    "www.xinhuanet.com": 8,
+}
+
+_fetch_lock = threading.Lock()
+FETCH_LEADER_LOCK = 7300  # chiave advisory: un solo fetcher attivo fra web e worker
+
+
+def _read_body(resp, deadline):
+    chunks = []
+    while True:
+        chunk = resp.read(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if time.monotonic() > deadline:
+            raise TimeoutError("deadline superata durante il download")
+    body = b"".join(chunks)
+    encoding = (resp.headers.get("Content-Encoding") or "").lower()
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "deflate":
+        body = zlib.decompress(body)
+    return body
+
+
+def _retry_after_seconds(value):
+    # Retry-After può essere un numero di secondi o una data HTTP
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(int((when - datetime.now(timezone.utc)).total_seconds()), 0)
+
+
+def entry_time(entry, fetched_at=None):
+    # feedparser normalizza già in UTC (struct_time); published prima di updated.
+    # Senza data, o con data nel futuro, vale l'ora del fetch (se data)
+    for key in ("published_parsed", "updated_parsed"):
+        parsed = entry.get(key)
+        if parsed:
+            try:
+                value = datetime(*parsed[:6], tzinfo=timezone.utc)
+            except (TypeError, ValueError):
+                continue
+            if fetched_at and value > fetched_at + PUBLISHED_FUTURE_TOLERANCE:
+                return fetched_at
+            return value
+    return fetched_at
+
+
+def _entry_times(entries):
+    return [t for t in (entry_time(entry) for entry in entries) if t]
+
+
+def plan_next_fetch(state, res, now):
+    # Intervallo ≈ tempo atteso per un nuovo item, dal ritmo stimato con media mobile;
+    # backoff esponenziale sugli errori consecutivi; ttl e Retry-After come limiti inferiori
+    state = state or {}
+    rate = state.get("rate")
+    interval = state.get("interval_s") or FEED_DEFAULT_INTERVAL
+    if res["error"]:
+        errors = (state.get("error_count") or 0) + 1
+        delay = min(interval * 2 ** errors, FEED_BACKOFF_MAX)
+        delay = max(delay, res.get("retry_after") or 0)
+        return {"rate": rate, "interval_s": interval, "error_count": errors,
+                "next_fetch_at": now + timedelta(seconds=delay)}
+
+    observed = None
+    last_fetched = state.get("last_fetched_at")
+    if isinstance(last_fetched, str):
+        last_fetched = datetime.fromisoformat(last_fetched)
+    if last_fetched and res.get("new_items") is not None:
+        hours = max((now - last_fetched).total_seconds() / 3600, 1 / 60)
+        observed = res["new_items"] / hours
+    elif rate is None and res.get("span_rate") is not None:
+        observed = res["span_rate"]
+    if observed is not None:
+        rate = observed if rate is None else FEED_RATE_ALPHA * observed + (1 - FEED_RATE_ALPHA) * rate
+
+    if rate is None:
+        interval = FEED_DEFAULT_INTERVAL
+    elif rate <= 0:
+        interval = FEED_MAX_INTERVAL
+    else:
+        interval = 3600 / rate
+    floor = max(FEED_MIN_INTERVAL, res.get("ttl") or 0)
+    interval = int(min(max(interval, floor), max(FEED_MAX_INTERVAL, floor)))
+    delay = max(interval, res.get("retry_after") or 0)
+    return {"rate": rate, "interval_s": interval, "error_count": 0,
+            "next_fetch_at": now + timedelta(seconds=delay)}
+
+
+def fetch_feed(source, url, state=None):
+    state = state or {}
+    result = {
+        "source": source, "status": None, "error": None, "entries": [],
+        "etag": state.get("etag"), "last_modified": state.get("last_modified"),
+        "duration_ms": 0, "fetch_ms": 0, "parse_ms": 0, "bytes": 0,
+        "ttl": None, "retry_after": None,
+    }
+    headers = {"User-Agent": FETCH_USER_AGENT, "Accept-Encoding": "gzip, deflate"}
+    if result["etag"]:
+        headers["If-None-Match"] = result["etag"]
+    if result["last_modified"]:
+        headers["If-Modified-Since"] = result["last_modified"]
+    timeout = HOST_TIMEOUTS.get(urlparse(url).hostname, FETCH_TIMEOUT)
+    started = time.monotonic()
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = _read_body(resp, started + timeout)
+            result["status"] = resp.status
+            result["etag"] = resp.headers.get("ETag") or result["etag"]
+            result["last_modified"] = resp.headers.get("Last-Modified") or result["last_modified"]
+            response_headers = {k.lower(): v for k, v in resp.headers.items()
+                                if k.lower() != "content-encoding"}
+        result["bytes"] = len(body)
+        result["fetch_ms"] = int((time.monotonic() - started) * 1000)
+        parse_started = time.monotonic()
+        feed = feedparser.parse(body, response_headers=response_headers)
+        result["entries"] = feed.entries[:30]
+        result["parse_ms"] = int((time.monotonic() - parse_started) * 1000)
+        ttl = str(feed.feed.get("ttl", "")).strip()
+        result["ttl"] = int(ttl) * 60 if ttl.isdigit() else None
+    except urllib.error.HTTPError as e:
+        result["status"] = e.code
+        if e.code != 304:
+            result["error"] = f"HTTP {e.code}"
+        result["retry_after"] = _retry_after_seconds(e.headers.get("Retry-After") if e.headers else None)
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+    result["duration_ms"] = int((time.monotonic() - started) * 1000)
+    if not result["fetch_ms"]:
+        result["fetch_ms"] = result["duration_ms"]
+    return result
+
+
+def fetch_due():
+    return fetch_all(due_only=True)
+
+
+def fetch_all(due_only=False):
+    # due_only: solo le fonti il cui next_fetch_at è scaduto (tick dello scheduler);
+    # altrimenti tutte, come nel refresh manuale.
+    # Un solo ciclo alla volta nel processo (scheduler + refresh manuale) e, con un advisory
+    # lock di sessione, in tutto il deployment: chi non ottiene il lock salta il giro.
+    # Il lock sta su una connessione dedicata, fuori dal pool: per tutto il ciclo (rete
+    # compresa) non occupa uno slot delle route e dei job. Chiuderla rilascia il lock,
+    # anche quando è la connessione a cadere.
+    if not _fetch_lock.acquire(blocking=False):
+        print("[SKIP] Fetch già in corso.")
+        return 0
+    try:
+        conn = psycopg2.connect(DATABASE_URL, sslmode=DB_SSLMODE)
         try:
-            feed = feedparser.parse(url)
-            for entry in feed.entries[:30]:
+            conn.autocommit = True
+            c = conn.cursor()
+            c.execute("SELECT pg_try_advisory_lock(%s)", (FETCH_LEADER_LOCK,))
+            if not c.fetchone()[0]:
+                print("[SKIP] Fetch in corso in un altro processo.")
+                return 0
+            return _fetch_cycle(due_only)
+        finally:
+            conn.close()
+    finally:
+        _fetch_lock.release()
+
+
+def _fetch_cycle(due_only=False):
+    cycle_at = datetime.now(timezone.utc)
+    started = time.monotonic()
+    states = load_feed_states()
+    sources = [source for source in FEEDS
+               if not due_only
+               or not (states.get(source) or {}).get("next_fetch_at")
+               or states[source]["next_fetch_at"] <= cycle_at]
+    if not sources:
+        return 0
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] Fetching {len(sources)}/{len(FEEDS)} feeds...")
+    results = []
+    rows = []
+    relevant = defaultdict(int)
+    filter_s = 0.0
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        futures = [pool.submit(fetch_feed, source, FEEDS[source][0], states.get(source))
+                   for source in sources]
+        # Le entry vengono processate man mano che i feed arrivano
+        for future in as_completed(futures):
+            res = future.result()
+            results.append(res)
+            perspective = FEEDS[res["source"]][1]
+            # Item nuovi rispetto al più recente già visto: misurano il ritmo della fonte
+            times = _entry_times(res["entries"])
+            latest = (states.get(res["source"]) or {}).get("latest_entry_at")
+            res["newest_entry_at"] = max(times) if times else None
+            if res["status"] == 304:
+                res["new_items"] = 0
+            elif latest and times:
+                res["new_items"] = sum(1 for t in times if t > latest)
+            else:
+                res["new_items"] = None
+            # Primo fetch: ritmo stimato dalle date delle entry stesse
+            span_hours = (max(times) - min(times)).total_seconds() / 3600 if len(times) > 1 else 0
+            res["span_rate"] = (len(times) - 1) / span_hours if span_hours else None
+            filter_started = time.monotonic()
+            for entry in res["entries"]:
                 title = entry.get("title", "")
                 link = entry.get("link", "")
                 summary = re.sub(r"<[^>]+>", "", entry.get("summary", ""))
-                published = entry.get("published", datetime.now().isoformat())
+                published = entry_time(entry, cycle_at)
                 if not link or not title:
                     continue
-                if not is_relevant(title, summary):
+                matched, category, _ = match_entry(title + " " + summary)
+                if not matched:
                     continue
-                category = categorize(title + " " + summary)
-                save_article(source, title, link, summary, published, category, perspective)
-                count += 1
-        except Exception as e:
-            print(f"Error fetching {source}: {e}")
-    print(f"[DONE] Saved {count} relevant articles.")
+                rows.append((res["source"], title, link, summary, published, category, perspective))
+                relevant[res["source"]] += 1
+            filter_s += time.monotonic() - filter_started
+            status = res["error"] or res["status"]
+            print(f"  [{res['source']}] {status} · {len(res['entries'])} entry · {res['duration_ms']} ms")
+    fetched = time.monotonic()
+    inserted_by_source, failed = save_articles(rows)
+    saved = time.monotonic()
+    # Fonti non salvate: ETag, Last-Modified e data più recente restano quelli di prima,
+    # così il ciclo successivo riscarica le stesse entry invece di ricevere un 304
+    for res in results:
+        if res["source"] in failed:
+            previous = states.get(res["source"]) or {}
+            res["etag"], res["last_modified"] = previous.get("etag"), previous.get("last_modified")
+            res["newest_entry_at"] = None
+    # Fonti senza date: in mancanza di meglio, il ritmo si misura sugli articoli inseriti
+    for res in results:
+        if (res["new_items"] is None and not res["error"] and not res["newest_entry_at"]
+                and res["source"] not in failed
+                and (states.get(res["source"]) or {}).get("last_fetched_at")):
+            res["new_items"] = inserted_by_source.get(res["source"], 0)
+    save_feed_states(results, states)
+    finished = time.monotonic()
+    inserted = sum(inserted_by_source.values())
+    not_modified = sum(1 for r in results if r["status"] == 304)
+    errors = sum(1 for r in results if r["error"])
+    unsaved = sum(relevant[source] for source in failed)
+    print(f"[DONE] Saved {inserted} new articles ({len(rows) - inserted - unsaved} duplicates, "
+          f"{unsaved} not saved) in {finished - started:.1f}s ({not_modified} not modified, {errors} errors).")
+    record_ingest_cycle(cycle_at, {
+        "total_ms": int((finished - started) * 1000),
+        "fetch_ms": int((fetched - started) * 1000),
+        "parse_ms": sum(r["parse_ms"] for r in results),
+        "filter_ms": int(filter_s * 1000),
+        "db_ms": int((saved - fetched) * 1000),
+        "state_ms": int((finished - saved) * 1000),
+    }, [{
+        "source": r["source"], "status": r["status"],
+        "error": r["error"] or ("DB: inserimento fallito" if r["source"] in failed else None),
+        "fetch_ms": r["fetch_ms"], "parse_ms": r["parse_ms"], "bytes": r["bytes"],
+        "parsed": len(r["entries"]), "relevant": relevant[r["source"]],
+        "inserted": inserted_by_source.get(r["source"], 0),
+        "duplicates": 0 if r["source"] in failed else relevant[r["source"]] - inserted_by_source.get(r["source"], 0),
+    } for r in results])
+    return inserted
+
+
+# ─────────────────────────────────────────────
+# METRICHE — ingestione per fase e per fonte, latenza delle route
+# ─────────────────────────────────────────────
+METRICS_WINDOW_HOURS = int(os.environ.get("METRICS_WINDOW_HOURS", 24))
+METRICS_RETENTION_DAYS = int(os.environ.get("METRICS_RETENTION_DAYS", 14))
+METRICS_REFRESH_SECONDS = 15
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FEED_COUNTERS = ("bytes", "parsed", "relevant", "inserted", "duplicates")
+STAGES = ("fetch", "parse", "filter", "db", "state", "total")
+
+
+def record_ingest_cycle(cycle_at, stages, sources):
+    # Un ciclo = una riga in ingest_cycles + una per fonte in feed_metrics.
+    # Un errore qui non deve far fallire l'ingestione
+    try:
+        with db() as conn:
+            c = conn.cursor()
+            c.execute("""
+                INSERT INTO ingest_cycles (started_at, total_ms, fetch_ms, parse_ms, filter_ms, db_ms, state_ms)
+                VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
+            """, (cycle_at, *(stages[f"{stage}_ms"] for stage in
+                              ("total", "fetch", "parse", "filter", "db", "state"))))
+            cycle_id = c.fetchone()[0]
+            execute_values(c, """
+                INSERT INTO feed_metrics (cycle_id, cycle_at, source, status, error, fetch_ms, parse_ms,
+                                          bytes, parsed, relevant, inserted, duplicates)
+                VALUES %s
+            """, [(cycle_id, cycle_at, m["source"], m["status"], m["error"], m["fetch_ms"], m["parse_ms"],
+                   m["bytes"], m["parsed"], m["relevant"], m["inserted"], m["duplicates"]) for m in sources])
+            c.execute("DELETE FROM ingest_cycles WHERE started_at < now() - make_interval(days => %s)",
+                      (METRICS_RETENTION_DAYS,))
+    except Exception as e:
+        print(f"[METRICS] errore salvataggio: {e}")
+
+
+# Finestra mobile in memoria, alimentata in modo incrementale dalle tabelle: funziona
+# anche nei processi web, dove l'ingestione non gira
+_metrics_lock = threading.Lock()
+_metrics_window = {"cycles": deque(), "feeds": deque(), "last_cycle_id": 0, "checked": 0.0}
+
+
+def metrics_window():
+    with _metrics_lock:
+        if time.monotonic() - _metrics_window["checked"] >= METRICS_REFRESH_SECONDS:
+            with db() as conn:
+                c = conn.cursor(cursor_factory=RealDictCursor)
+                c.execute("""SELECT * FROM ingest_cycles
+                             WHERE id > %s AND started_at > now() - make_interval(hours => %s)
+                             ORDER BY id""", (_metrics_window["last_cycle_id"], METRICS_WINDOW_HOURS))
+                cycles = [dict(r) for r in c.fetchall()]
+                if cycles:
+                    c.execute("SELECT * FROM feed_metrics WHERE cycle_id >= %s ORDER BY id", (cycles[0]["id"],))
+                    _metrics_window["feeds"].extend(dict(r) for r in c.fetchall())
+                    _metrics_window["cycles"].extend(cycles)
+                    _metrics_window["last_cycle_id"] = cycles[-1]["id"]
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=METRICS_WINDOW_HOURS)
+            for key, field in (("cycles", "started_at"), ("feeds", "cycle_at")):
+                window = _metrics_window[key]
+                while window and window[0][field] < cutoff:
+                    window.popleft()
+            _metrics_window["checked"] = time.monotonic()
+        return list(_metrics_window["cycles"]), list(_metrics_window["feeds"])
+
+
+def feed_health(feeds):
+    # Aggregati per fonte sulla finestra: una fonte con errors == fetches è morta
+    out = {}
+    for m in feeds:
+        h = out.setdefault(m["source"], {
+            "source": m["source"], "fetches": 0, "errors": 0, "fetch_ms_total": 0, "fetch_ms_max": 0,
+            **{k: 0 for k in FEED_COUNTERS}, "last_status": None, "last_error": None,
+            "last_fetch_at": None, "last_success_at": None,
+        })
+        h["fetches"] += 1
+        h["errors"] += 1 if m["error"] else 0
+        h["fetch_ms_total"] += m["fetch_ms"] or 0
+        h["fetch_ms_max"] = max(h["fetch_ms_max"], m["fetch_ms"] or 0)
+        for k in FEED_COUNTERS:
+            h[k] += m[k] or 0
+        h["last_status"], h["last_error"], h["last_fetch_at"] = m["status"], m["error"], m["cycle_at"]
+        if not m["error"]:
+            h["last_success_at"] = m["cycle_at"]
+    for h in out.values():
+        h["fetch_ms_avg"] = round(h.pop("fetch_ms_total") / h["fetches"], 1)
+    return sorted(out.values(), key=lambda h: (-h["errors"], -h["fetch_ms_avg"]))
+
+
+_http_lock = threading.Lock()
+_http_histograms = {}   # (endpoint, method) → [conteggi per bucket..., +Inf], somma
+_http_requests = defaultdict(int)   # (endpoint, method, status) → richieste
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _stamp_response(response):
+    # Per le risposte in streaming (SSE) conta il tempo fino al primo byte
+    if "request_started" in g:
+        g.response_elapsed = time.perf_counter() - g.request_started
+        g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def _observe_request(exc):
+    # In teardown e non in after_request: gira anche quando la view o un hook solleva,
+    # così i 500 finiscono nell'istogramma e nei contatori
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    elapsed = g.pop("response_elapsed", None)
+    if elapsed is None:
+        elapsed = time.perf_counter() - started
+    status = 500 if exc is not None else g.pop("response_status", 500)
+    key = (request.endpoint or "not_found", request.method)
+    with _http_lock:
+        buckets, _ = _http_histograms.setdefault(key, ([0] * (len(HTTP_BUCKETS) + 1), [0.0]))
+        for i, bound in enumerate(HTTP_BUCKETS):
+            if elapsed <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        _http_histograms[key][1][0] += elapsed
+        _http_requests[(*key, status)] += 1
+
+
+def _prom_labels(**labels):
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for k, v in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus():
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{_prom_labels(**labels) if labels else ''} {value}")
+
+    with _http_lock:
+        histograms = {k: (list(b), s[0]) for k, (b, s) in _http_histograms.items()}
+        requests_total = dict(_http_requests)
+    lines.append("# HELP theatrum_http_request_duration_seconds Latenza delle richieste HTTP per route")
+    lines.append("# TYPE theatrum_http_request_duration_seconds histogram")
+    for (endpoint, method), (buckets, total) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(HTTP_BUCKETS + ("+Inf",), buckets):
+            cumulative += count
+            labels = _prom_labels(endpoint=endpoint, method=method, le=bound)
+            lines.append(f"theatrum_http_request_duration_seconds_bucket{labels} {cumulative}")
+        labels = _prom_labels(endpoint=endpoint, method=method)
+        lines.append(f"theatrum_http_request_duration_seconds_sum{labels} {round(total, 6)}")
+        lines.append(f"theatrum_http_request_duration_seconds_count{labels} {cumulative}")
+    metric("theatrum_http_requests_total", "counter", "Richieste HTTP per route e status",
+           [({"endpoint": e, "method": m, "status": st}, n) for (e, m, st), n in sorted(requests_total.items())])
+
+    pool = pool_stats()
+    metric("theatrum_db_pool_in_use", "gauge", "Connessioni del pool in uso", [({}, pool["in_use"])])
+    metric("theatrum_db_pool_timeouts_total", "counter", "Checkout del pool scaduti", [({}, pool["timeouts"])])
+
+    try:
+        cycles, feeds = metrics_window()
+    except Exception as e:
+        print(f"[METRICS] errore lettura: {e}")
+        return "\n".join(lines) + "\n"
+    if cycles:
+        last = cycles[-1]
+        metric("theatrum_ingest_stage_seconds", "gauge", "Durata delle fasi dell'ultimo ciclo di ingestione",
+               [({"stage": stage}, last[f"{stage}_ms"] / 1000) for stage in STAGES])
+        metric("theatrum_ingest_last_cycle_timestamp_seconds", "gauge", "Inizio dell'ultimo ciclo",
+               [({}, int(last["started_at"].timestamp()))])
+    health = feed_health(feeds)
+    window = f"nelle ultime {METRICS_WINDOW_HOURS} ore"
+    metric("theatrum_feed_up", "gauge", "1 se l'ultimo fetch della fonte è riuscito",
+           [({"source": h["source"]}, 0 if h["last_error"] else 1) for h in health])
+    metric("theatrum_feed_fetches", "gauge", f"Fetch per fonte {window}",
+           [({"source": h["source"]}, h["fetches"]) for h in health])
+    metric("theatrum_feed_errors", "gauge", f"Fetch falliti per fonte {window}",
+           [({"source": h["source"]}, h["errors"]) for h in health])
+    metric("theatrum_feed_fetch_seconds_avg", "gauge", f"Latenza media di fetch per fonte {window}",
+           [({"source": h["source"]}, h["fetch_ms_avg"] / 1000) for h in health])
+    metric("theatrum_feed_fetch_seconds_max", "gauge", f"Latenza massima di fetch per fonte {window}",
+           [({"source": h["source"]}, h["fetch_ms_max"] / 1000) for h in health])
+    for k in FEED_COUNTERS:
+        metric(f"theatrum_feed_{k}", "gauge", f"Totale '{k}' per fonte {window}",
+               [({"source": h["source"]}, h[k]) for h in health])
+    return "\n".join(lines) + "\n"
 
 
 # ─────────────────────────────────────────────
 # SELEZIONE BILANCIATA PER PROSPETTIVA
 # ─────────────────────────────────────────────
-def select_balanced_articles(all_articles, max_total=25, max_per_perspective=4):
-    by_perspective = defaultdict(list)
-    for a in all_articles:
-        by_perspective[a.get('perspective', 'other')].append(a)
+# Politica di selezione: i default riproducono esattamente il round-robin storico
+DEFAULT_SELECTION_POLICY = {
+    "recency_weight": 0.0,              # posizioni perse per ogni ora di età dell'articolo
+    "max_per_source": None,             # tetto di articoli per singola testata
+    "near_duplicate_threshold": None,   # Jaccard minima fra titoli per scartare un quasi-duplicato
+    "dedupe_key": None,                 # funzione articolo → chiave (una sola scelta per chiave)
+}
+ANALYSIS_SELECTION_POLICY = {
+    "max_per_source": 2,
+    "near_duplicate_threshold": 0.6,
+    "dedupe_key": lambda a: a.get("cluster_id"),   # un solo articolo per storia
+}
 
-    selected = []
-    seen_links = set()
 
-    top = all_articles[:10]
-    for a in top:
-        if a['link'] not in seen_links:
-            selected.append(a)
-            seen_links.add(a['link'])
+def _article_age_hours(a, now):
+    value = a.get("published") or a.get("fetched_at")
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return 0.0
+    if not isinstance(value, datetime) or value.tzinfo is None:
+        return 0.0
+    return max((now - value).total_seconds() / 3600, 0.0)
 
-    perspectives = list(by_perspective.keys())
-    per_perspective_count = defaultdict(int)
-    for a in selected:
-        per_perspective_count[a.get('perspective', 'other')] += 1
 
-    remaining = [a for a in all_articles[10:] if a['link'] not in seen_links]
-    i = 0
-    while len(selected) < max_total and i < len(remaining) * 2:
-        for persp in perspectives:
+def _title_tokens(title):
+    return {w for w in re.findall(r"\w+", (title or "").lower()) if len(w) > 2}
+
+
+def select_balanced_articles(all_articles, max_total=25, max_per_perspective=4, policy=None):
+    policy = {**DEFAULT_SELECTION_POLICY, **(policy or {})}
+    articles = all_articles
+    if policy["recency_weight"]:
+        now = datetime.now(timezone.utc)
+        weight = policy["recency_weight"]
+        ranked = sorted(enumerate(all_articles), key=lambda ia: ia[0] + weight * _article_age_hours(ia[1], now))
+        articles = [a for _, a in ranked]
+
+    selected = []
+    seen_links = set()
+    per_perspective_count = defaultdict(int)
+    per_source_count = defaultdict(int)
+    dedupe_keys = set()
+    selected_tokens = []
+    max_per_source = policy["max_per_source"]
+    dedupe_key = policy["dedupe_key"]
+    threshold = policy["near_duplicate_threshold"]
+
+    # I criteri sono monotoni: un articolo scartato una volta resta scartato
+    def accept(a):
+        if a['link'] in seen_links:
+            return False
+        if max_per_source and per_source_count[a.get('source')] >= max_per_source:
+            return False
+        if dedupe_key and dedupe_key(a) is not None and dedupe_key(a) in dedupe_keys:
+            return False
+        if threshold:
+            tokens = _title_tokens(a.get('title'))
+            for other in selected_tokens:
+                union = len(tokens | other)
+                if union and len(tokens & other) / union >= threshold:
+                    return False
+        return True
+
+    def take(a, persp):
+        selected.append(a)
+        seen_links.add(a['link'])
+        per_perspective_count[persp] += 1
+        per_source_count[a.get('source')] += 1
+        if dedupe_key and dedupe_key(a) is not None:
+            dedupe_keys.add(dedupe_key(a))
+        if threshold:
+            selected_tokens.append(_title_tokens(a.get('title')))
+
+    for a in articles[:10]:
+        if accept(a):
+            take(a, a.get('perspective', 'other'))
+
+    # Una coda per prospettiva, nell'ordine di rilevanza: ogni giro pesca la prima
+    # candidata valida di ciascuna e si ferma quando tutte le code sono esaurite
+    perspectives = list(dict.fromkeys(a.get('perspective', 'other') for a in articles))
+    queues = defaultdict(deque)
+    for a in articles[10:]:
+        queues[a.get('perspective')].append(a)
+    active = perspectives
+    while len(selected) < max_total and active:
+        still_active = []
+        for persp in active:
             if len(selected) >= max_total:
                 break
-            candidates = [a for a in remaining
-                         if a.get('perspective') == persp
-                         and a['link'] not in seen_links
-                         and per_perspective_count[persp] < max_per_perspective]
-            if candidates:
-                a = candidates[0]
-                selected.append(a)
-                seen_links.add(a['link'])
-                per_perspective_count[persp] += 1
-        i += 1
+            queue = queues.get(persp)
+            if not queue or per_perspective_count[persp] >= max_per_perspective:
+                continue
+            while queue and not accept(queue[0]):
+                queue.popleft()
+            if queue:
+                take(queue.popleft(), persp)
+            if queue and per_perspective_count[persp] < max_per_perspective:
+                still_active.append(persp)
+        active = still_active
 
     return selected
 
@@ -311,23 +2351,224 @@ def select_balanced_articles(all_articles, max_total=25, max_per_perspective=4):
 # ─────────────────────────────────────────────
 # CLAUDE API
 # ─────────────────────────────────────────────
-def call_claude(prompt):
-    if not ANTHROPIC_API_KEY:
-        return "API key non configurata."
-    try:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=5000,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return message.content[0].text
-    except Exception as e:
-        print(f"Claude API error: {e}")
-        return f"Errore API Claude: {e}"
+# Limite per processo alle chiamate Claude contemporanee (quello globale è JOB_MAX_RUNNING)
+_claude_slots = threading.BoundedSemaphore(CLAUDE_CONCURRENCY)
+
+
+CLAUDE_GOVERNOR_LOCK = 7304  # chiave advisory: una decisione del governor alla volta
+CLAUDE_GOVERNOR_POLL = 1.0
+
+
+class RateGovernor:
+    # Finestra scorrevole di 60 s su richieste e token di input, in claude_calls: i limiti
+    # valgono per l'intero deploy, non per processo. acquire blocca finché la chiamata non
+    # rientra nei limiti (una chiamata sola passa sempre, anche se enorme) e ritorna l'id
+    # della riga; settle sostituisce la stima con l'usage reale; pause ferma tutti dopo un 429.
+    # Chi aspetta ricontrolla almeno ogni CLAUDE_GOVERNOR_POLL secondi, perché un settle
+    # altrove può liberare token prima della scadenza della finestra
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+
+    def acquire(self, tokens):
+        if not self.rpm and not self.tpm:
+            return None
+        while True:
+            with db() as conn:
+                c = conn.cursor()
+                c.execute("SELECT pg_advisory_xact_lock(%s)", (CLAUDE_GOVERNOR_LOCK,))
+                c.execute("DELETE FROM claude_calls WHERE at <= clock_timestamp() - interval '60 seconds'")
+                c.execute("""
+                    SELECT count(*), COALESCE(sum(tokens), 0),
+                           EXTRACT(EPOCH FROM min(at) + interval '60 seconds' - clock_timestamp()),
+                           EXTRACT(EPOCH FROM (SELECT paused_until FROM claude_governor WHERE id = 1)
+                                              - clock_timestamp())
+                    FROM claude_calls
+                """)
+                calls, used, window_wait, pause_wait = c.fetchone()
+                if pause_wait is not None and pause_wait > 0:
+                    wait = float(pause_wait)
+                elif ((not self.rpm or calls < self.rpm)
+                        and (not self.tpm or not calls or used + tokens <= self.tpm)):
+                    c.execute("INSERT INTO claude_calls (tokens) VALUES (%s) RETURNING id", (tokens,))
+                    return c.fetchone()[0]
+                else:
+                    wait = float(window_wait or 0)
+            time.sleep(min(max(wait, 0.05), CLAUDE_GOVERNOR_POLL))
+
+    def settle(self, event, tokens):
+        if event is None:
+            return
+        with db() as conn:
+            conn.cursor().execute("UPDATE claude_calls SET tokens = %s WHERE id = %s", (tokens, event))
+
+    def pause(self, seconds):
+        if not self.rpm and not self.tpm:
+            return
+        with db() as conn:
+            conn.cursor().execute("""
+                UPDATE claude_governor
+                SET paused_until = GREATEST(paused_until, clock_timestamp() + make_interval(secs => %s))
+                WHERE id = 1
+            """, (seconds,))
+
+
+_claude_governor = RateGovernor(CLAUDE_RPM, CLAUDE_TPM)
+
+_claude_client = None
+_claude_client_lock = threading.Lock()
+
+
+def get_claude_client():
+    # Un solo client (e un solo pool HTTP) per processo. I retry li gestisce call_claude,
+    # che li coordina col governor: quelli interni dell'SDK sono disattivati
+    global _claude_client
+    if _claude_client is None:
+        with _claude_client_lock:
+            if _claude_client is None:
+                _claude_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, max_retries=0)
+    return _claude_client
+
+
+def set_claude_client(client):
+    # Client alternativo (stub locale, benchmark): stessa interfaccia beta.prompt_caching.messages
+    global _claude_client
+    with _claude_client_lock:
+        _claude_client = client
+
+
+def _claude_retry_delay(error, attempt):
+    # None se l'errore non è transitorio (400, 401, ...); altrimenti Retry-After o backoff esponenziale
+    if isinstance(error, anthropic.APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        retry_after = _retry_after_seconds(error.response.headers.get("retry-after"))
+        if retry_after is not None:
+            return retry_after
+    elif not isinstance(error, anthropic.APIConnectionError):
+        return None
+    return min(2 ** attempt, 60) + random.uniform(0, 1)
+
+
+def call_claude(prompt, system=None, on_text=None):
+    # Ritorna (testo, usage). on_text: callback per ogni frammento → API in streaming
+    if not ANTHROPIC_API_KEY and _claude_client is None:
+        return "API key non configurata.", {}
+    started = time.monotonic()
+    request_args = dict(
+        model=CLAUDE_MODEL,
+        max_tokens=5000,
+        messages=[{"role": "user", "content": prompt}]
+    )
+    if system:
+        request_args["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+    estimate = (len(prompt) + len(system or "")) // 4
+    streamed = []
+    attempt = 0
+    while True:
+        event = _claude_governor.acquire(estimate)
+        try:
+            messages = get_claude_client().beta.prompt_caching.messages
+            with _claude_slots:
+                if on_text is None:
+                    message = messages.create(**request_args)
+                else:
+                    with messages.stream(**request_args) as stream:
+                        for text in stream.text_stream:
+                            streamed.append(text)
+                            on_text(text)
+                        message = stream.get_final_message()
+            break
+        except Exception as e:
+            _claude_governor.settle(event, 0)
+            # Un flusso già arrivato al browser non si può ripetere senza duplicarlo
+            delay = _claude_retry_delay(e, attempt) if not streamed else None
+            if delay is None or attempt >= CLAUDE_MAX_RETRIES:
+                print(f"Claude API error: {e}")
+                return f"Errore API Claude: {e}", {}
+            if isinstance(e, anthropic.RateLimitError):
+                _claude_governor.pause(delay)
+            attempt += 1
+            print(f"[CLAUDE] {type(e).__name__}, nuovo tentativo {attempt}/{CLAUDE_MAX_RETRIES} fra {delay:.1f}s")
+            time.sleep(delay)
+    usage = {
+        "input_tokens": message.usage.input_tokens,
+        "cache_read_tokens": message.usage.cache_read_input_tokens or 0,
+        "cache_write_tokens": message.usage.cache_creation_input_tokens or 0,
+        "output_tokens": message.usage.output_tokens,
+        "latency_ms": int((time.monotonic() - started) * 1000),
+        "attempts": attempt + 1,
+    }
+    _claude_governor.settle(event, usage["input_tokens"] + usage["cache_write_tokens"])
+    return message.content[0].text, usage
+
+
+# Parte fissa del prompt (metodo, sezioni, regole dello script): va nel blocco system
+# marcato per il prompt caching, così a ogni analisi viaggia solo la parte variabile
+ANALYSIS_SYSTEM_PROMPT = """Sei un analista di intelligence geopolitica. Il tuo metodo è la MAPPATURA DELLE NARRATIVE: non cerchi una verità unica, ma mappi cosa dice ogni prospettiva editoriale, dove convergono e dove divergono.
+
+Produci un'analisi in 6 sezioni. Usa ESATTAMENTE questi titoli di sezione:
+
+## 1. MAPPA DELLE NARRATIVE
+Per ogni prospettiva presente, sintetizza in 2-3 frasi cosa dice e quale frame interpretativo usa. Sii preciso e fedele a ciò che le fonti dicono realmente — non attribuire posizioni non documentate. Formato: **[Prospettiva]**: testo.
+
+## 2. CONVERGENZE
+Cosa concordano tutte o quasi tutte le prospettive? Questi sono i fatti più solidi. Max 150 parole.
+
+## 3. DIVERGENZE E CONFLITTI NARRATIVI
+Dove le prospettive si contraddicono radicalmente? Quali sono i punti di scontro narrativo più rilevanti? Quali domande rimangono aperte? Max 200 parole.
+
+## 4. PROSPETTIVA DEL DIRITTO INTERNAZIONALE
+Valutazione basata su fatti convergenti (non su narrative di parte): Carta ONU, Convenzioni di Ginevra, diritto umanitario. Max 150 parole.
+
+## 5. FILO NARRATIVO
+Se esistono analisi precedenti, come si è evoluta la situazione? Quali previsioni si sono avverate? Cosa è cambiato nel conflitto narrativo? Se è la prima analisi, stabilisci i marcatori per il futuro. Max 150 parole.
+
+## 6. SCRIPT INSTAGRAM (90 secondi, bilingue IT/EN)
+Pezzo giornalistico autonomo per voce AI. Non è un riassunto dell'analisi — è un racconto con un solo angolo, una sola storia, un solo filo.
+
+REGOLA FONDAMENTALE: prima di scrivere, valuta il peso del fatto principale. Se il fatto principale è esso stesso senza precedenti o anomalo — un attacco militare dichiarato, una svolta storica, una rottura di equilibri consolidati — quello è la storia, raccontala con tutto il suo peso. Se invece il fatto principale è ordinario, allora cerca UN'anomalia secondaria — un silenzio strano, un paradosso che emerge solo leggendo tutto insieme. In entrambi i casi, usa la profondità dell'analisi: le 8 prospettive, le convergenze, le divergenze, il filo storico non sono decorazione — sono il materiale con cui costruisci la lettura. Lo script deve sembrare scritto da qualcuno che sa più cose di chi lo ascolta, non da qualcuno che ha letto solo i titoli. Quando citi comportamenti editoriali di una testata, nomina sempre la testata esplicitamente.
+
+Struttura interna (non dichiarare i titoli, non usare intestazioni nel testo):
+
+— Apri con il fatto anomalo. Concreto, specifico, misurabile. Una o due frasi al massimo. L'ascoltatore deve sentire che c'è qualcosa che non quadra.
+
+— Costruisci il contesto minimo necessario. Una o due forze in gioco, non sei. Chi decide, chi tace, cosa si muove sotto la superficie. Scritto per chi è intelligente ma non segue la notizia ogni giorno.
 
+— Mostra la tensione reale: non "chi dice cosa" ma cosa rivela il modo in cui lo dicono. Il silenzio di una fonte è narrativa. L'assenza di un attore è narrativa. Una fonte che parla d'altro proprio oggi è narrativa. Usa questo.
+
+— Chiudi con una tensione irrisolta — qualcosa che l'ascoltatore può portarsi via e verificare da solo nei giorni successivi. Non una domanda retorica. Un fatto sospeso.
+
+Tono: autorevole e tagliente, come un corrispondente con vent'anni di esperienza che sa cosa sta guardando e non ha bisogno di urlarlo. Non freddo — lucido. La differenza è che il freddo descrive, il lucido interpreta. Usa i fatti come lame, non come mattoni. Ogni frase deve guadagnarsi il posto: se non aggiunge prospettiva o tensione, toglila. Almeno un riferimento storico concreto e preciso — non "come sempre accade" ma "come nel [anno], quando [fatto specifico]" — che riveli perché questo momento è diverso o uguale a qualcosa che conosciamo già. Ritmo variabile: frasi brevi e secche per i fatti, frasi più distese per l'interpretazione. Circa 180-200 parole per lingua. Prima italiano, poi inglese. Niente elenchi, niente titoletti, niente markdown nel testo finale.
+
+Rispondi SOLO con le 6 sezioni. Usa ESATTAMENTE i titoli indicati sopra."""
+
+
+# Limiti (caratteri) della sintesi dell'analisi precedente nel prompt incrementale
+DIGEST_LIMITS = {"narrative_map": 220, "convergences": 500, "divergences": 500, "legal": 300, "thread": 300}
+
+
+def _clip(text, limit):
+    text = " ".join((text or "").split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + "…"
 
-def generate_analysis(keywords_list, articles, previous_analyses=None):
+
+def analysis_digest(base):
+    # Sintesi strutturata: una riga per prospettiva della mappa, le altre sezioni accorciate
+    lines = [f"[{str(base['created_at'])[:16].replace('T', ' ')}] {base['keywords']}", "NARRATIVE:"]
+    for line in (base.get("narrative_map") or "").splitlines():
+        if line.strip():
+            lines.append(f"- {_clip(line, DIGEST_LIMITS['narrative_map'])}")
+    for key, label in [("convergences", "CONVERGENZE"), ("divergences", "DIVERGENZE"),
+                       ("legal", "DIRITTO INTERNAZIONALE"), ("thread", "FILO NARRATIVO")]:
+        if base.get(key):
+            lines.append(f"{label}: {_clip(base[key], DIGEST_LIMITS[key])}")
+    return "\n".join(lines)
+
+
+def generate_analysis(keywords_list, articles, previous_analyses=None, on_text=None, base_digest=None):
     by_perspective = defaultdict(list)
     for a in articles:
         by_perspective[a.get('perspective', 'other')].append(a)
@@ -345,15 +2586,27 @@ def generate_analysis(keywords_list, articles, previous_analyses=None):
 
     keywords_str = ", ".join(keywords_list)
 
+    if base_digest:
+        # Aggiornamento: solo gli articoli nuovi + la sintesi dell'analisi precedente
+        prompt = f"""TEMA: {keywords_str}
+AGGIORNAMENTO DI UN'ANALISI ESISTENTE. Sintesi dell'analisi precedente:
+{base_digest}
+
+PROSPETTIVE NEGLI ARTICOLI NUOVI: {', '.join(perspectives_present)}
+
+ARTICOLI NUOVI DALL'ANALISI PRECEDENTE, PER PROSPETTIVA:
+{articles_text}
+
+Aggiorna l'analisi precedente alla luce dei soli articoli nuovi: conserva ciò che resta valido, correggi ciò che è superato, integra le prospettive nuove. Nel FILO NARRATIVO spiega cosa è cambiato rispetto all'analisi precedente. Produci l'analisi completa secondo il metodo, con ESATTAMENTE i 6 titoli di sezione indicati."""
+        return call_claude(prompt, system=ANALYSIS_SYSTEM_PROMPT, on_text=on_text)
+
     history_context = ""
     if previous_analyses:
         history_context = "\n\nANALISI PRECEDENTI SULLO STESSO TEMA:\n"
         for pa in previous_analyses[:2]:
             history_context += f"\n[{pa['created_at'][:10]}]\n{pa['narrative_map'][:400]}...\n"
 
-    prompt = f"""Sei un analista di intelligence geopolitica. Il tuo metodo è la MAPPATURA DELLE NARRATIVE: non cerchi una verità unica, ma mappi cosa dice ogni prospettiva editoriale, dove convergono e dove divergono.
-
-TEMA: {keywords_str}
+    prompt = f"""TEMA: {keywords_str}
 PROSPETTIVE PRESENTI: {', '.join(perspectives_present)}
 PROSPETTIVE ASSENTI (nessun articolo disponibile): {', '.join(perspectives_missing) if perspectives_missing else 'nessuna'}
 {history_context}
@@ -361,67 +2614,61 @@ PROSPETTIVE ASSENTI (nessun articolo disponibile): {', '.join(perspectives_missi
 ARTICOLI PER PROSPETTIVA:
 {articles_text}
 
-Produci un'analisi in 6 sezioni. Usa ESATTAMENTE questi titoli di sezione:
+Produci l'analisi secondo il metodo, con ESATTAMENTE i 6 titoli di sezione indicati."""
 
-## 1. MAPPA DELLE NARRATIVE
-Per ogni prospettiva presente, sintetizza in 2-3 frasi cosa dice e quale frame interpretativo usa. Sii preciso e fedele a ciò che le fonti dicono realmente — non attribuire posizioni non documentate. Formato: **[Prospettiva]**: testo.
-
-## 2. CONVERGENZE
-Cosa concordano tutte o quasi tutte le prospettive? Questi sono i fatti più solidi. Max 150 parole.
-
-## 3. DIVERGENZE E CONFLITTI NARRATIVI
-Dove le prospettive si contraddicono radicalmente? Quali sono i punti di scontro narrativo più rilevanti? Quali domande rimangono aperte? Max 200 parole.
-
-## 4. PROSPETTIVA DEL DIRITTO INTERNAZIONALE
-Valutazione basata su fatti convergenti (non su narrative di parte): Carta ONU, Convenzioni di Ginevra, diritto umanitario. Max 150 parole.
-
-## 5. FILO NARRATIVO
-Se esistono analisi precedenti, come si è evoluta la situazione? Quali previsioni si sono avverate? Cosa è cambiato nel conflitto narrativo? Se è la prima analisi, stabilisci i marcatori per il futuro. Max 150 parole.
-
-## 6. SCRIPT INSTAGRAM (90 secondi, bilingue IT/EN)
-Pezzo giornalistico autonomo per voce AI. Non è un riassunto dell'analisi — è un racconto con un solo angolo, una sola storia, un solo filo.
+    return call_claude(prompt, system=ANALYSIS_SYSTEM_PROMPT, on_text=on_text)
 
-REGOLA FONDAMENTALE: prima di scrivere, valuta il peso del fatto principale. Se il fatto principale è esso stesso senza precedenti o anomalo — un attacco militare dichiarato, una svolta storica, una rottura di equilibri consolidati — quello è la storia, raccontala con tutto il suo peso. Se invece il fatto principale è ordinario, allora cerca UN'anomalia secondaria — un silenzio strano, un paradosso che emerge solo leggendo tutto insieme. In entrambi i casi, usa la profondità dell'analisi: le 8 prospettive, le convergenze, le divergenze, il filo storico non sono decorazione — sono il materiale con cui costruisci la lettura. Lo script deve sembrare scritto da qualcuno che sa più cose di chi lo ascolta, non da qualcuno che ha letto solo i titoli. Quando citi comportamenti editoriali di una testata, nomina sempre la testata esplicitamente.
-
-Struttura interna (non dichiarare i titoli, non usare intestazioni nel testo):
 
-— Apri con il fatto anomalo. Concreto, specifico, misurabile. Una o due frasi al massimo. L'ascoltatore deve sentire che c'è qualcosa che non quadra.
+SECTIONS = [
+    ("narrative_map", "1. MAPPA DELLE NARRATIVE"),
+    ("convergences", "2. CONVERGENZE"),
+    ("divergences", "3. DIVERGENZE E CONFLITTI NARRATIVI"),
+    ("legal", "4. PROSPETTIVA DEL DIRITTO INTERNAZIONALE"),
+    ("thread", "5. FILO NARRATIVO"),
+    ("instagram_script", "SCRIPT INSTAGRAM"),
+]
+_SECTION_HEADER_RE = re.compile(r"^## ", re.MULTILINE)
 
-— Costruisci il contesto minimo necessario. Una o due forze in gioco, non sei. Chi decide, chi tace, cosa si muove sotto la superficie. Scritto per chi è intelligente ma non segue la notizia ogni giorno.
 
-— Mostra la tensione reale: non "chi dice cosa" ma cosa rivela il modo in cui lo dicono. Il silenzio di una fonte è narrativa. L'assenza di un attore è narrativa. Una fonte che parla d'altro proprio oggi è narrativa. Usa questo.
+def parse_sections(text):
+    def extract_section(text, title):
+        pattern = rf"## {re.escape(title)}\n(.*?)(?=\n## |\Z)"
+        match = re.search(pattern, text, re.DOTALL)
+        return match.group(1).strip() if match else ""
 
-— Chiudi con una tensione irrisolta — qualcosa che l'ascoltatore può portarsi via e verificare da solo nei giorni successivi. Non una domanda retorica. Un fatto sospeso.
+    def extract_fuzzy(text, keyword):
+        pattern = rf"## [^\n]*{re.escape(keyword)}[^\n]*\n(.*?)(?=\n## |\Z)"
+        match = re.search(pattern, text, re.DOTALL)
+        return match.group(1).strip() if match else ""
 
-Tono: autorevole e tagliente, come un corrispondente con vent'anni di esperienza che sa cosa sta guardando e non ha bisogno di urlarlo. Non freddo — lucido. La differenza è che il freddo descrive, il lucido interpreta. Usa i fatti come lame, non come mattoni. Ogni frase deve guadagnarsi il posto: se non aggiunge prospettiva o tensione, toglila. Almeno un riferimento storico concreto e preciso — non "come sempre accade" ma "come nel [anno], quando [fatto specifico]" — che riveli perché questo momento è diverso o uguale a qualcosa che conosciamo già. Ritmo variabile: frasi brevi e secche per i fatti, frasi più distese per l'interpretazione. Circa 180-200 parole per lingua. Prima italiano, poi inglese. Niente elenchi, niente titoletti, niente markdown nel testo finale.
+    # FIX: fallback "" su ogni sezione — nessun None arriva a save_analysis
+    sections = {key: extract_section(text, title) or "" for key, title in SECTIONS[:-1]}
+    key, keyword = SECTIONS[-1]
+    sections[key] = extract_fuzzy(text, keyword) or ""
+    return sections
 
-Rispondi SOLO con le 6 sezioni. Usa ESATTAMENTE i titoli indicati sopra."""
 
-    return call_claude(prompt)
+def completed_sections(partial):
+    # Durante lo streaming una sezione è completa solo quando è iniziata la successiva
+    headers = list(_SECTION_HEADER_RE.finditer(partial))
+    if len(headers) < 2:
+        return {}
+    return {k: v for k, v in parse_sections(partial[:headers[-1].start()]).items() if v}
 
 
-def run_analysis_job(job_id, keywords, articles, previous):
-    jobs[job_id]["status"] = "running"
+def run_analysis_job(job_id, keywords, articles, previous, cache_key=None, base=None, articles_until=None):
+    stream = _open_job_stream(job_id)
     try:
-        raw = generate_analysis(keywords, articles, previous)
-
-        def extract_section(text, title):
-            pattern = rf"## {re.escape(title)}\n(.*?)(?=\n## |\Z)"
-            match = re.search(pattern, text, re.DOTALL)
-            return match.group(1).strip() if match else ""
-
-        def extract_fuzzy(text, keyword):
-            pattern = rf"## [^\n]*{re.escape(keyword)}[^\n]*\n(.*?)(?=\n## |\Z)"
-            match = re.search(pattern, text, re.DOTALL)
-            return match.group(1).strip() if match else ""
-
-        # FIX: fallback "" su ogni sezione — nessun None arriva a save_analysis
-        narrative_map = extract_section(raw, "1. MAPPA DELLE NARRATIVE") or ""
-        convergences  = extract_section(raw, "2. CONVERGENZE") or ""
-        divergences   = extract_section(raw, "3. DIVERGENZE E CONFLITTI NARRATIVI") or ""
-        legal         = extract_section(raw, "4. PROSPETTIVA DEL DIRITTO INTERNAZIONALE") or ""
-        thread        = extract_section(raw, "5. FILO NARRATIVO") or ""
-        instagram     = extract_fuzzy(raw, "SCRIPT INSTAGRAM") or ""
+        raw, usage = generate_analysis(keywords, articles, previous, on_text=stream.append,
+                                       base_digest=base["digest"] if base else None)
+
+        sections = parse_sections(raw)
+        narrative_map = sections["narrative_map"]
+        convergences  = sections["convergences"]
+        divergences   = sections["divergences"]
+        legal         = sections["legal"]
+        thread        = sections["thread"]
+        instagram     = sections["instagram_script"]
 
         # Se le sezioni principali sono tutte vuote, probabilmente il formato è diverso
         # Logghiamo il raw per debug futuro
@@ -433,11 +2680,12 @@ def run_analysis_job(job_id, keywords, articles, previous):
             by_perspective[a.get('perspective', 'other')].append(a)
         perspectives_used = {p: PERSPECTIVE_LABELS.get(p, p) for p in by_perspective.keys()}
 
-        save_analysis(", ".join(keywords), len(articles),
-                     narrative_map, convergences, divergences, legal, thread, instagram)
+        analysis_id = save_analysis(", ".join(keywords), len(articles),
+                                    narrative_map, convergences, divergences, legal, thread, instagram,
+                                    usage=usage, article_links=[a["link"] for a in articles],
+                                    articles_until=articles_until, base_id=base["id"] if base else None)
 
-        jobs[job_id]["status"] = "done"
-        jobs[job_id]["result"] = {
+        result = {
             "keywords": keywords,
             "article_count": len(articles),
             "articles": articles[:15],
@@ -448,12 +2696,351 @@ def run_analysis_job(job_id, keywords, articles, previous):
             "legal": legal,
             "thread": thread,
             "instagram_script": instagram,
-            "has_history": len(previous) > 0
+            "has_history": len(previous) > 0 or base is not None,
+            "base_id": base["id"] if base else None
         }
+        if cache_key and (narrative_map or convergences):
+            store_cached_analysis(cache_key, analysis_id, result)
+        finish_job(job_id, result={**result, "analysis_id": analysis_id})
     except Exception as e:
-        jobs[job_id]["status"] = "error"
-        jobs[job_id]["error"] = str(e)
+        finish_job(job_id, error=str(e))
         print(f"[ERROR] Job {job_id}: {e}")
+    finally:
+        _close_job_stream(job_id)
+
+
+# ─────────────────────────────────────────────
+# STREAMING — testo parziale dei job verso il browser (SSE)
+# ─────────────────────────────────────────────
+STREAM_FLUSH_INTERVAL = 1.0
+STREAM_KEEPALIVE = 15
+# Polling del DB per i job sugli altri worker: si parte da STREAM_POLL_MIN e si raddoppia
+# finché il parziale non cambia, fino a STREAM_POLL_MAX
+STREAM_POLL_MIN = 0.5
+STREAM_POLL_MAX = 2.0
+
+_job_streams_lock = threading.Lock()
+_job_streams = {}
+
+
+class JobStream:
+    # Buffer del testo generato: notifica i client SSE locali e salva periodicamente
+    # il parziale in jobs.partial per quelli collegati agli altri worker
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.text = ""
+        self.done = False
+        self.cond = threading.Condition()
+        self._flushed_at = 0.0
+
+    def append(self, chunk):
+        with self.cond:
+            self.text += chunk
+            self.cond.notify_all()
+        if time.monotonic() - self._flushed_at > STREAM_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        try:
+            with db() as conn:
+                conn.cursor().execute("UPDATE jobs SET partial = %s WHERE id = %s", (self.text, self.job_id))
+        except Exception as e:
+            print(f"[STREAM] flush {self.job_id}: {e}")
+
+    def close(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def wait(self, seen, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.done or len(self.text) > seen, timeout=timeout)
+            return self.text
+
+
+def _open_job_stream(job_id):
+    stream = JobStream(job_id)
+    with _job_streams_lock:
+        _job_streams[job_id] = stream
+    return stream
+
+
+def _close_job_stream(job_id):
+    with _job_streams_lock:
+        stream = _job_streams.pop(job_id, None)
+    if stream:
+        stream.close()
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=_json_default)}\n\n"
+
+
+def job_events(job_id):
+    sent = 0
+    emitted = set()
+    last_event = time.monotonic()
+    poll = STREAM_POLL_MIN
+    while True:
+        with _job_streams_lock:
+            stream = _job_streams.get(job_id)
+        if stream:
+            text = stream.wait(sent, timeout=STREAM_KEEPALIVE)
+            job = {"status": "running"}
+        else:
+            # Job su un altro worker (o già concluso): si legge lo stato dal DB
+            with db() as conn:
+                c = conn.cursor(cursor_factory=RealDictCursor)
+                c.execute("SELECT status, partial, result, error FROM jobs WHERE id = %s", (job_id,))
+                job = c.fetchone()
+            if not job:
+                yield _sse("error", {"error": "Job non trovato"})
+                return
+            text = job["partial"] or ""
+        if len(text) > sent:
+            yield _sse("delta", {"text": text[sent:]})
+            sent = len(text)
+            last_event = time.monotonic()
+            poll = STREAM_POLL_MIN
+        for key, content in completed_sections(text).items():
+            if key not in emitted:
+                emitted.add(key)
+                yield _sse("section", {"key": key, "content": content})
+        if job["status"] == "done":
+            for key, _ in SECTIONS:
+                if key not in emitted and job["result"].get(key):
+                    yield _sse("section", {"key": key, "content": job["result"][key]})
+            yield _sse("done", job["result"])
+            return
+        if job["status"] == "error":
+            yield _sse("error", {"error": job["error"]})
+            return
+        if time.monotonic() - last_event > STREAM_KEEPALIVE:
+            yield ": keepalive\n\n"
+            last_event = time.monotonic()
+        if not stream:
+            time.sleep(poll)
+            poll = min(poll * 2, STREAM_POLL_MAX)
+
+
+# ─────────────────────────────────────────────
+# CACHE ANALISI — chiave: keyword normalizzate + link selezionati + prompt + modello
+# ─────────────────────────────────────────────
+def analysis_cache_key(keywords, articles):
+    material = {
+        "keywords": sorted({k.strip().lower() for k in keywords}),
+        "links": sorted(a["link"] for a in articles),
+        "prompt_version": PROMPT_VERSION,
+        "model": CLAUDE_MODEL,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+
+def get_cached_analyses(cache_keys):
+    # Più chiavi in un solo UPDATE; ritorna {cache_key: risultato} per quelle ancora valide
+    if not cache_keys:
+        return {}
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("""UPDATE analysis_cache SET hits = hits + 1, last_hit_at = now()
+                     WHERE cache_key = ANY(%s) AND created_at > now() - %s * interval '1 hour'
+                     RETURNING cache_key, result, analysis_id""",
+                  (list(cache_keys), ANALYSIS_CACHE_MAX_AGE_HOURS))
+        rows = c.fetchall()
+    return {key: {**result, "analysis_id": analysis_id, "cached": True} for key, result, analysis_id in rows}
+
+
+def get_cached_analysis(cache_key):
+    return get_cached_analyses([cache_key]).get(cache_key)
+
+
+def store_cached_analysis(cache_key, analysis_id, result):
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("""
+            INSERT INTO analysis_cache (cache_key, analysis_id, result) VALUES (%s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE SET
+                analysis_id = EXCLUDED.analysis_id, result = EXCLUDED.result,
+                created_at = now(), last_hit_at = NULL, hits = 0
+        """, (cache_key, analysis_id, _json(result)))
+        # Eviction: voci scadute, poi le meno usate oltre il limite di dimensione
+        # Ore anche frazionarie (0.5 = 30 minuti): make_interval(hours => int) le troncherebbe
+        c.execute("DELETE FROM analysis_cache WHERE created_at < now() - %s * interval '1 hour'",
+                  (ANALYSIS_CACHE_MAX_AGE_HOURS,))
+        c.execute("""DELETE FROM analysis_cache WHERE cache_key IN (
+                         SELECT cache_key FROM analysis_cache
+                         ORDER BY COALESCE(last_hit_at, created_at) DESC OFFSET %s)""",
+                  (ANALYSIS_CACHE_MAX_ENTRIES,))
+
+
+# ─────────────────────────────────────────────
+# CODA JOB — tabella jobs su Postgres (SKIP LOCKED)
+# ─────────────────────────────────────────────
+JOB_CLAIM_LOCK = 7301  # chiave advisory: serializza i claim per rispettare JOB_MAX_RUNNING
+JOB_POLL_INTERVAL = 2
+JOB_HEARTBEAT_INTERVAL = 30
+
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+_job_wakeup = threading.Event()
+_job_workers_lock = threading.Lock()
+_job_workers = []
+_last_job_sweep = [0.0]
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} non serializzabile")
+
+
+def _json(value):
+    return Json(value, dumps=lambda v: json.dumps(v, default=_json_default))
+
+
+def enqueue_job(keywords, articles, previous, cache_key=None, base=None, articles_until=None):
+    job_id = str(uuid.uuid4())
+    payload = {"keywords": keywords, "articles": articles, "previous": previous, "cache_key": cache_key,
+               "base": base, "articles_until": articles_until}
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO jobs (id, payload) VALUES (%s, %s)", (job_id, _json(payload)))
+    _job_wakeup.set()
+    return job_id
+
+
+def enqueue_batch(batch_id, entries):
+    # entries: (payload, status, result, error) per tema, nell'ordine del batch; una sola INSERT.
+    # I temi già risolti (cache, nessun articolo) entrano come job conclusi
+    job_ids = [str(uuid.uuid4()) for _ in entries]
+    now = datetime.now(timezone.utc)
+    with db() as conn:
+        c = conn.cursor()
+        execute_values(c, """
+            INSERT INTO jobs (id, payload, status, result, error, batch_id, finished_at) VALUES %s
+        """, [(job_id, _json({**payload, "batch_index": i}), status,
+               _json(result) if result is not None else None, error, batch_id,
+               None if status == "pending" else now)
+              for i, (job_id, (payload, status, result, error)) in enumerate(zip(job_ids, entries))])
+    _job_wakeup.set()
+    return job_ids
+
+
+def get_batch(batch_id):
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute("""SELECT id, status, error, result, payload->'keywords' AS keywords
+                     FROM jobs WHERE batch_id = %s
+                     ORDER BY (payload->>'batch_index')::int""", (batch_id,))
+        return [dict(r) for r in c.fetchall()]
+
+
+def get_job_status(job_id):
+    # Solo stato e avanzamento (caratteri generati): il risultato si legge una volta a parte
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute("""SELECT status, error, COALESCE(length(partial), 0) AS partial_chars,
+                            (result->>'analysis_id')::int AS analysis_id
+                     FROM jobs WHERE id = %s""", (job_id,))
+        row = c.fetchone()
+    if not row:
+        return None
+    return {k: v for k, v in row.items() if v is not None}
+
+
+def get_job(job_id):
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute("SELECT status, result, error FROM jobs WHERE id = %s", (job_id,))
+        row = c.fetchone()
+    if not row:
+        return None
+    return {k: v for k, v in row.items() if v is not None}
+
+
+def claim_job():
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute("SELECT pg_advisory_xact_lock(%s)", (JOB_CLAIM_LOCK,))
+        c.execute("SELECT COUNT(*) AS n FROM jobs WHERE status = 'running'")
+        if c.fetchone()["n"] >= JOB_MAX_RUNNING:
+            return None
+        c.execute("""
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = %s,
+                            started_at = now(), heartbeat_at = now()
+            WHERE id = (SELECT id FROM jobs WHERE status = 'pending'
+                        ORDER BY created_at FOR UPDATE SKIP LOCKED LIMIT 1)
+            RETURNING id, payload
+        """, (_WORKER_ID,))
+        return c.fetchone()
+
+
+def finish_job(job_id, result=None, error=None):
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("""UPDATE jobs SET status = %s, result = %s, error = %s, finished_at = now()
+                     WHERE id = %s""",
+                  ("error" if error else "done", _json(result) if result is not None else None, error, job_id))
+
+
+def sweep_jobs():
+    # Job "running" senza heartbeat (worker morto o riavviato) tornano in coda fino a
+    # JOB_MAX_ATTEMPTS; i risultati più vecchi di JOB_TTL_HOURS vengono eliminati
+    with db() as conn:
+        c = conn.cursor()
+        stale = "status = 'running' AND heartbeat_at < now() - make_interval(secs => %s)"
+        c.execute(f"UPDATE jobs SET status = 'pending', worker = NULL WHERE {stale} AND attempts < %s",
+                  (JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS))
+        recovered = c.rowcount
+        c.execute(f"""UPDATE jobs SET status = 'error', error = 'Job interrotto troppe volte', finished_at = now()
+                      WHERE {stale} AND attempts >= %s""", (JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS))
+        c.execute("""DELETE FROM jobs WHERE status IN ('done', 'error')
+                     AND finished_at < now() - make_interval(hours => %s)""", (int(JOB_TTL_HOURS),))
+        expired = c.rowcount
+    if recovered or expired:
+        print(f"[JOBS] {recovered} job ripresi, {expired} risultati scaduti eliminati.")
+
+
+def _heartbeat(job_id, stop):
+    while not stop.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            with db() as conn:
+                conn.cursor().execute("UPDATE jobs SET heartbeat_at = now() WHERE id = %s", (job_id,))
+        except Exception as e:
+            print(f"[JOBS] heartbeat {job_id}: {e}")
+
+
+def _job_worker():
+    while True:
+        try:
+            if time.monotonic() - _last_job_sweep[0] > 60:
+                _last_job_sweep[0] = time.monotonic()
+                sweep_jobs()
+            job = claim_job()
+        except Exception as e:
+            print(f"[JOBS] errore coda: {e}")
+            job = None
+        if not job:
+            _job_wakeup.wait(JOB_POLL_INTERVAL)
+            _job_wakeup.clear()
+            continue
+        payload = job["payload"]
+        stop = threading.Event()
+        threading.Thread(target=_heartbeat, args=(job["id"], stop), daemon=True).start()
+        try:
+            run_analysis_job(job["id"], payload["keywords"], payload["articles"], payload["previous"],
+                             cache_key=payload.get("cache_key"), base=payload.get("base"),
+                             articles_until=payload.get("articles_until"))
+        finally:
+            stop.set()
+
+
+def start_job_workers():
+    with _job_workers_lock:
+        while len(_job_workers) < JOB_WORKERS:
+            t = threading.Thread(target=_job_worker, daemon=True)
+            t.start()
+            _job_workers.append(t)
 
 
 # ─────────────────────────────────────────────
@@ -464,44 +3051,106 @@ def index():
     return render_template("index.html")
 
 
+NEWS_FIELDS = ("id", "source", "title", "link", "summary", "published", "category", "fetched_at", "cluster_id")
+
+
+def parse_fields(allowed, default=None):
+    # ?fields=a,b,c → campi richiesti nell'ordine di allowed; ValueError se sconosciuti
+    raw = request.args.get("fields")
+    if not raw:
+        return list(default or allowed)
+    wanted = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = wanted - set(allowed)
+    if unknown:
+        raise ValueError(f"Campi sconosciuti: {', '.join(sorted(unknown))}")
+    return [f for f in allowed if f in wanted]
+
+
 @app.route("/api/news")
+@cached_response(max_age=60)
 def api_news():
     category = request.args.get("category", "all")
     source = request.args.get("source", "all")
-    limit = int(request.args.get("limit", 60))
-    offset = int(request.args.get("offset", 0))
-    conn = get_conn()
-    c = conn.cursor(cursor_factory=RealDictCursor)
-    query = "SELECT source, title, link, summary, published, category, fetched_at FROM articles WHERE 1=1"
-    params = []
+    cursor = request.args.get("cursor")
+    collapse = request.args.get("collapse") == "1"
+    try:
+        limit = max(1, min(int(request.args.get("limit", 60)), 200))
+        offset = max(0, int(request.args.get("offset", 0)))
+        summary_chars = max(0, min(int(request.args.get("summary_chars", 500)), 500))
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    try:
+        fields = parse_fields(NEWS_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # id e fetched_at servono comunque al cursore; il sommario si può accorciare in SQL
+    columns = sorted(set(fields) | {"id", "fetched_at"}, key=NEWS_FIELDS.index)
+    select = ", ".join("left(summary, %s) AS summary" if f == "summary" else f for f in columns)
+    query = f"SELECT {select} FROM articles WHERE 1=1"
+    params = [summary_chars] if "summary" in columns else []
+    filters = []
     if category != "all":
-        query += " AND category = %s"
-        params.append(category)
+        filters.append(("category = %s", category))
     if source != "all":
-        query += " AND source = %s"
-        params.append(source)
-    query += " ORDER BY fetched_at DESC LIMIT %s OFFSET %s"
-    params.extend([limit, offset])
-    c.execute(query, params)
-    rows = [dict(r) for r in c.fetchall()]
-    conn.close()
-    return jsonify(rows)
+        filters.append(("source = %s", source))
+    try:
+        since = parse_time_window(request.args.get("hours"), request.args.get("since"))
+    except ValueError:
+        return jsonify({"error": "Finestra temporale non valida"}), 400
+    if since:
+        filters.append(("published >= %s", since))
+    for condition, value in filters:
+        query += " AND " + condition
+        params.append(value)
+    # Un solo articolo per cluster: il più recente fra quelli che passano gli stessi filtri
+    if collapse:
+        query += (" AND NOT EXISTS (SELECT 1 FROM articles n WHERE n.cluster_id = articles.cluster_id"
+                  " AND (n.fetched_at, n.id) > (articles.fetched_at, articles.id)"
+                  + "".join(" AND n." + condition for condition, _ in filters) + ")")
+        params.extend(value for _, value in filters)
+    # Keyset: ogni pagina costa uguale a qualunque profondità; offset resta per compatibilità
+    if cursor:
+        try:
+            params.extend(decode_cursor(cursor))
+        except ValueError:
+            return jsonify({"error": "Cursor non valido"}), 400
+        query += " AND (fetched_at, id) < (%s, %s)"
+    query += " ORDER BY fetched_at DESC, id DESC LIMIT %s"
+    params.append(limit)
+    if offset and not cursor:
+        query += " OFFSET %s"
+        params.append(offset)
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute(query, params)
+        rows = [dict(r) for r in c.fetchall()]
+    timestamps = [f for f in ("published", "fetched_at") if f in fields]
+    response = jsonify([{**{f: r[f] for f in fields}, **{f: _isoformat(r[f]) for f in timestamps}}
+                        for r in rows])
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["fetched_at"], rows[-1]["id"])
+    return response
 
 
 @app.route("/api/stats")
+@cached_response(max_age=60)
 def api_stats():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM articles")
-    total = c.fetchone()[0]
-    c.execute("SELECT category, COUNT(*) FROM articles GROUP BY category ORDER BY COUNT(*) DESC")
-    by_cat = {r[0]: r[1] for r in c.fetchall()}
-    c.execute("SELECT source, COUNT(*) FROM articles GROUP BY source ORDER BY COUNT(*) DESC")
-    by_source = {r[0]: r[1] for r in c.fetchall()}
-    c.execute("SELECT MAX(fetched_at) FROM articles")
-    last_update = c.fetchone()[0]
-    conn.close()
-    return jsonify({"total": total, "by_category": by_cat, "by_source": by_source, "last_update": last_update})
+    _, stats = get_stats()
+    return jsonify(stats)
+
+
+@app.route("/api/trends")
+@cached_response(max_age=60)
+def api_trends():
+    try:
+        hours = int(request.args.get("hours", TREND_WINDOW_HOURS))
+        baseline_hours = int(request.args.get("baseline_hours", TREND_BASELINE_HOURS))
+        limit = min(int(request.args.get("limit", 20)), 100)
+    except ValueError:
+        return jsonify({"error": "Parametri non validi"}), 400
+    if not 1 <= hours <= 48 or not 1 <= baseline_hours <= TREND_BASELINE_HOURS or limit < 1:
+        return jsonify({"error": "Finestra non valida"}), 400
+    return jsonify(compute_trends(hours, baseline_hours, limit))
 
 
 @app.route("/api/refresh", methods=["POST"])
@@ -512,12 +3161,26 @@ def manual_refresh():
     return jsonify({"status": "refresh started"})
 
 
+@app.route("/metrics")
+def metrics():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return Response("Non autorizzato\n", status=401, mimetype="text/plain")
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+# Categorie e fonti dipendono solo dalla configurazione: versione (e quindi ETag) costante
+# per processo, le due route restano disponibili anche con il DB giù
+CONFIG_VERSION = hashlib.sha1(json.dumps([list(CATEGORY_TAGS), list(FEEDS)]).encode()).hexdigest()
+
+
 @app.route("/api/categories")
+@cached_response(max_age=3600, version=CONFIG_VERSION)
 def api_categories():
     return jsonify(list(CATEGORY_TAGS.keys()))
 
 
 @app.route("/api/sources")
+@cached_response(max_age=3600, version=CONFIG_VERSION)
 def api_sources():
     return jsonify(list(FEEDS.keys()))
 
@@ -560,68 +3223,279 @@ def api_analyze():
     if not keywords:
         return jsonify({"error": "Inserisci almeno una keyword"}), 400
 
-    conn = get_conn()
-    c = conn.cursor(cursor_factory=RealDictCursor)
-    conditions = " OR ".join(["(LOWER(title) LIKE %s OR LOWER(summary) LIKE %s)" for _ in keywords])
-    params = []
-    for kw in keywords:
-        params.extend([f"%{kw}%", f"%{kw}%"])
-    c.execute(f"""SELECT source, title, link, summary, published, category, perspective
-                  FROM articles WHERE {conditions}
-                  ORDER BY id DESC LIMIT 500""", params)
-    all_articles = [dict(r) for r in c.fetchall()]
-
-    kw_conditions = " OR ".join(["LOWER(keywords) LIKE %s" for _ in keywords])
-    kw_params = [f"%{kw}%" for kw in keywords]
-    c.execute(f"SELECT narrative_map, created_at FROM analyses WHERE {kw_conditions} ORDER BY created_at DESC LIMIT 2", kw_params)
-    previous = [dict(r) for r in c.fetchall()]
-    conn.close()
+    try:
+        since = parse_time_window(data.get("hours", ANALYSIS_WINDOW_HOURS), data.get("since"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Finestra temporale non valida"}), 400
+
+    # incremental: solo gli articoli ingeriti dopo l'analisi di partenza (base_id o l'ultima
+    # con le stesse keyword) più una sintesi di quella; senza analisi di partenza è completa
+    base = None
+    articles_until = datetime.now(timezone.utc)
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        if data.get("incremental"):
+            try:
+                base_id = int(data["base_id"]) if data.get("base_id") is not None else None
+            except (TypeError, ValueError):
+                return jsonify({"error": "base_id non valido"}), 400
+            base = find_base_analysis(c, keywords, base_id)
+            if base_id is not None and not base:
+                return jsonify({"error": "Analisi di partenza non trovata"}), 404
+        if base:
+            cutoff = base["articles_until"] or parse_time_window(since=base["created_at"])
+            seen = set(base["article_links"] or [])
+            all_articles = [a for a in search_articles(c, keywords, since=since, fetched_after=cutoff)
+                            if a["link"] not in seen]
+            previous = []
+        else:
+            all_articles = search_articles(c, keywords, since=since)
+            previous = find_previous_analyses(c, keywords)
+    all_articles = rank_by_relevance(keywords, all_articles)
 
     if not all_articles:
-        return jsonify({"error": f"Nessun articolo trovato per: {', '.join(keywords)}"}), 404
-
-    articles = select_balanced_articles(all_articles, max_total=25, max_per_perspective=4)
+        if base:
+            return jsonify({"error": f"Nessun articolo nuovo per: {', '.join(keywords)} "
+                                     f"dall'analisi del {cutoff.strftime('%d/%m/%Y %H:%M')} UTC"}), 404
+        window = f" dal {since.strftime('%d/%m/%Y %H:%M')} UTC" if since else ""
+        return jsonify({"error": f"Nessun articolo trovato per: {', '.join(keywords)}{window}"}), 404
+
+    articles = select_balanced_articles(all_articles, max_total=25, max_per_perspective=4,
+                                        policy=ANALYSIS_SELECTION_POLICY)
+
+    # force: ignora la cache e rigenera (aggiornando la voce); no_cache: né lettura né scrittura.
+    # Gli aggiornamenti incrementali dipendono dall'analisi di partenza: niente cache
+    force = bool(data.get("force"))
+    no_cache = bool(data.get("no_cache")) or base is not None
+    cache_key = None if no_cache else analysis_cache_key(keywords, articles)
+    if cache_key and not force:
+        cached = get_cached_analysis(cache_key)
+        if cached:
+            return jsonify({"cached": True, "result": cached,
+                            "article_count": len(all_articles), "selected": len(articles)})
+
+    base_job = {"id": base["id"], "digest": analysis_digest(base)} if base else None
+    job_id = enqueue_job(keywords, articles, previous, cache_key=cache_key,
+                         base=base_job, articles_until=articles_until)
+
+    return jsonify({"job_id": job_id, "article_count": len(all_articles), "selected": len(articles),
+                    "incremental": base is not None, "base_id": base["id"] if base else None})
+
+
+@app.route("/api/admin/analyze/batch", methods=["POST"])
+def api_analyze_batch():
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
 
-    job_id = str(uuid.uuid4())
-    jobs[job_id] = {"status": "pending"}
-    t = threading.Thread(target=run_analysis_job, args=(job_id, keywords, articles, previous))
-    t.daemon = True
-    t.start()
+    data = request.json or {}
+    raw_topics = data.get("topics") or []
+    if not isinstance(raw_topics, list):
+        return jsonify({"error": "topics deve essere una lista"}), 400
+    topics = []
+    for i, topic in enumerate(raw_topics):
+        # Un tema è "a, b" oppure ["a", "b"]: altri tipi sono un errore del client, non un 500
+        if isinstance(topic, str):
+            topic = topic.split(",")
+        elif not isinstance(topic, list) or not all(isinstance(k, str) for k in topic):
+            return jsonify({"error": f"Tema {i + 1} non valido: attesa una stringa o una lista di stringhe"}), 400
+        keywords = [k.strip().lower() for k in topic if k.strip()]
+        if keywords and keywords not in topics:
+            topics.append(keywords)
+    if not topics:
+        return jsonify({"error": "Inserisci almeno un tema"}), 400
+    if len(topics) > BATCH_MAX_TOPICS:
+        return jsonify({"error": f"Massimo {BATCH_MAX_TOPICS} temi per batch"}), 400
 
-    return jsonify({"job_id": job_id, "article_count": len(all_articles), "selected": len(articles)})
+    try:
+        since = parse_time_window(data.get("hours", ANALYSIS_WINDOW_HOURS), data.get("since"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Finestra temporale non valida"}), 400
+
+    # Articoli e storico per tutti i temi: una query ciascuno, qualunque sia il numero di temi
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        found = search_articles_batch(c, topics, since=since)
+        previous = find_previous_analyses_batch(c, topics)
+
+    force = bool(data.get("force"))
+    no_cache = bool(data.get("no_cache"))
+    payloads = []
+    for keywords, all_articles, prev in zip(topics, found, previous):
+        payload = {"keywords": keywords, "articles": [], "previous": prev, "cache_key": None}
+        if all_articles:
+            articles = select_balanced_articles(rank_by_relevance(keywords, all_articles), max_total=25,
+                                                max_per_perspective=4, policy=ANALYSIS_SELECTION_POLICY)
+            cache_key = None if no_cache else analysis_cache_key(keywords, articles)
+            payload.update(articles=articles, cache_key=cache_key)
+        payloads.append(payload)
+    # Cache letta con un solo UPDATE per tutte le chiavi del batch
+    cached = {} if force else get_cached_analyses([p["cache_key"] for p in payloads if p["cache_key"]])
+    entries = []
+    for payload in payloads:
+        if not payload["articles"]:
+            entries.append((payload, "error", None,
+                            f"Nessun articolo trovato per: {', '.join(payload['keywords'])}"))
+        elif payload["cache_key"] in cached:
+            entries.append((payload, "done", cached[payload["cache_key"]], None))
+        else:
+            entries.append((payload, "pending", None, None))
+
+    # Le chiamate Claude partono in parallelo sui worker della coda (fino a JOB_MAX_RUNNING),
+    # regolate dal governor di call_claude
+    batch_id = str(uuid.uuid4())
+    job_ids = enqueue_batch(batch_id, entries)
+    return jsonify({"batch_id": batch_id, "jobs": [
+        {"job_id": job_id, "keywords": payload["keywords"], "status": status,
+         "selected": len(payload["articles"]), **({"error": error} if error else {})}
+        for job_id, (payload, status, _, error) in zip(job_ids, entries)]})
+
+
+@app.route("/api/admin/batch/<batch_id>")
+def api_batch_status(batch_id):
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    try:
+        fields = parse_fields(ANALYSIS_RESULT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    jobs = get_batch(batch_id)
+    if not jobs:
+        return jsonify({"error": "Batch non trovato"}), 404
+    out = []
+    for job in jobs:
+        item = {"job_id": job["id"], "keywords": job["keywords"], "status": job["status"]}
+        if job["error"]:
+            item["error"] = job["error"]
+        if job["result"] is not None:
+            item["result"] = {k: v for k, v in job["result"].items() if k in fields}
+        out.append(item)
+    finished = all(j["status"] in ("done", "error") for j in jobs)
+    return jsonify({"batch_id": batch_id, "status": "done" if finished else "running", "jobs": out})
 
 
 @app.route("/api/admin/job/<job_id>")
 def api_job_status(job_id):
     if not session.get("admin"):
         return jsonify({"error": "Non autorizzato"}), 403
-    job = jobs.get(job_id)
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job non trovato"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/admin/job/<job_id>/status")
+def api_job_poll(job_id):
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    job = get_job_status(job_id)
     if not job:
         return jsonify({"error": "Job non trovato"}), 404
     return jsonify(job)
 
 
+ANALYSIS_RESULT_FIELDS = ("keywords", "article_count", "articles", "perspectives_used", "narrative_map",
+                          "convergences", "divergences", "legal", "thread", "instagram_script",
+                          "has_history", "base_id", "analysis_id", "cached")
+
+
+@app.route("/api/admin/job/<job_id>/result")
+def api_job_result(job_id):
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    try:
+        fields = parse_fields(ANALYSIS_RESULT_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job non trovato"}), 404
+    if job["status"] != "done":
+        return jsonify({"status": job["status"], "error": job.get("error")}), 409
+    return jsonify({k: v for k, v in job["result"].items() if k in fields})
+
+
+@app.route("/api/admin/job/<job_id>/stream")
+def api_job_stream(job_id):
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    return Response(stream_with_context(job_events(job_id)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/api/admin/feeds")
+def api_feeds_status():
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute("""SELECT source, last_status, last_error, last_duration_ms, last_entries, last_fetched_at,
+                            rate, interval_s, error_count, next_fetch_at
+                     FROM feed_state ORDER BY last_duration_ms DESC NULLS LAST""")
+        rows = [{**r, "next_fetch_at": _isoformat(r["next_fetch_at"])} for r in c.fetchall()]
+    return jsonify(rows)
+
+
+@app.route("/api/admin/db")
+def api_db_status():
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    return jsonify(pool_stats())
+
+
+@app.route("/api/admin/metrics")
+def api_metrics_status():
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    cycles, feeds = metrics_window()
+    with _http_lock:
+        http = [{"endpoint": e, "method": m, "requests": sum(b), "avg_ms": round(s[0] / sum(b) * 1000, 1)}
+                for (e, m), (b, s) in sorted(_http_histograms.items())]
+    return jsonify({
+        "window_hours": METRICS_WINDOW_HOURS,
+        "cycles": [{**c, "started_at": _isoformat(c["started_at"])} for c in cycles[-24:]],
+        "sources": [{**h, "last_fetch_at": _isoformat(h["last_fetch_at"]),
+                     "last_success_at": _isoformat(h["last_success_at"])} for h in feed_health(feeds)],
+        "http": http,
+    })
+
+
+@app.route("/api/admin/cache")
+def api_cache_status():
+    if not session.get("admin"):
+        return jsonify({"error": "Non autorizzato"}), 403
+    return jsonify(response_cache_stats())
+
+
 @app.route("/api/admin/analyses")
 def api_analyses_history():
     if not session.get("admin"):
         return jsonify({"error": "Non autorizzato"}), 403
-    conn = get_conn()
-    c = conn.cursor(cursor_factory=RealDictCursor)
-    c.execute("SELECT id, keywords, article_count, created_at FROM analyses ORDER BY created_at DESC LIMIT 50")
-    rows = [dict(r) for r in c.fetchall()]
-    conn.close()
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute("""SELECT id, keywords, article_count, created_at,
+                            input_tokens, cache_read_tokens, cache_write_tokens, output_tokens, latency_ms, base_id
+                     FROM analyses ORDER BY created_at DESC LIMIT 50""")
+        rows = [dict(r) for r in c.fetchall()]
     return jsonify(rows)
 
 
+ANALYSIS_FIELDS = ("id", "keywords", "article_count", "narrative_map", "convergences", "divergences", "legal",
+                   "thread", "instagram_script", "created_at", "input_tokens", "cache_read_tokens",
+                   "cache_write_tokens", "output_tokens", "latency_ms", "article_links", "articles_until", "base_id")
+
+
 @app.route("/api/admin/analyses/<int:analysis_id>")
 def api_analysis_detail(analysis_id):
     if not session.get("admin"):
         return jsonify({"error": "Non autorizzato"}), 403
-    conn = get_conn()
-    c = conn.cursor(cursor_factory=RealDictCursor)
-    c.execute("SELECT * FROM analyses WHERE id = %s", (analysis_id,))
-    row = c.fetchone()
-    conn.close()
+    try:
+        fields = parse_fields(ANALYSIS_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    with db() as conn:
+        c = conn.cursor(cursor_factory=RealDictCursor)
+        c.execute(f"SELECT {', '.join(fields)} FROM analyses WHERE id = %s", (analysis_id,))
+        row = c.fetchone()
     if not row:
         return jsonify({"error": "Non trovata"}), 404
     return jsonify(dict(row))
@@ -632,25 +3506,55 @@ def api_analysis_detail(analysis_id):
 def api_analysis_delete(analysis_id):
     if not session.get("admin"):
         return jsonify({"error": "Non autorizzato"}), 403
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM analyses WHERE id = %s", (analysis_id,))
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM analyses WHERE id = %s", (analysis_id,))
     return jsonify({"deleted": analysis_id})
 
 # ─────────────────────────────────────────────
 # STARTUP
 # ─────────────────────────────────────────────
-init_db()
-_startup_thread = threading.Thread(target=fetch_all)
-_startup_thread.daemon = True
-_startup_thread.start()
+# L'import non tocca il DB: schema e worker delle analisi partono alla prima richiesta.
+# L'ingestione gira in ingest.py; INGEST_IN_WEB=1 la riporta nel processo web
+# (deploy a servizio singolo), tanto l'advisory lock garantisce un solo fetcher.
+INGEST_IN_WEB = os.environ.get("INGEST_IN_WEB", "0") == "1"
+
+_startup_lock = threading.Lock()
+_started = False
+
+
+def schedule_ingestion(scheduler):
+    # Un tick al minuto: ogni fonte viene scaricata quando scade il suo next_fetch_at
+    scheduler.add_job(fetch_due, "interval", seconds=SCHEDULER_TICK_SECONDS, id="fetch_feeds",
+                      next_run_time=datetime.now(), max_instances=1, coalesce=True)
+    scheduler.add_job(compact_articles, "interval", hours=6, id="compact_articles",
+                      max_instances=1, coalesce=True)
+    return scheduler
+
+
+def start_ingestion():
+    ensure_schema()
+    scheduler = schedule_ingestion(BackgroundScheduler())
+    scheduler.start()
+    return scheduler
+
+
+@app.before_request
+def _lazy_startup():
+    global _started
+    if _started:
+        return
+    with _startup_lock:
+        if _started:
+            return
+        ensure_schema()
+        start_job_workers()
+        if INGEST_IN_WEB:
+            start_ingestion()
+        _started = True
 
-_scheduler = BackgroundScheduler()
-_scheduler.add_job(fetch_all, "interval", hours=1, id="fetch_feeds")
-_scheduler.start()
 
 if __name__ == "__main__":
+    INGEST_IN_WEB = True
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
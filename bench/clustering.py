@@ -0,0 +1,55 @@
+"""Benchmark del clustering MinHash/LSH su un ciclo completo di feed registrati.
+
+    python -m bench.clustering [--repeat N]
+
+Misura firme + assegnazione dei cluster per tutte le entry delle fixture, come se
+fossero tutte nuove (caso peggiore di save_articles), senza toccare il DB.
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+
+from app import ClusterIndex, minhash_signature
+from bench.corpus import load_entries
+
+
+def cluster(entries):
+    index = ClusterIndex()
+    now = datetime.now(timezone.utc)
+    assignments = []
+    for article_id, (title, summary) in enumerate(entries, start=1):
+        signature = minhash_signature(title, summary)
+        if signature is None:
+            assignments.append(article_id)
+            continue
+        cluster_id = index.match(signature) or article_id
+        index.add(article_id, cluster_id, signature, now)
+        assignments.append(cluster_id)
+    return assignments
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    entries = load_entries()
+    best = float("inf")
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        assignments = cluster(entries)
+        best = min(best, time.perf_counter() - started)
+    print(f"{len(entries)} entry, best of {args.repeat}: {best * 1e3:.1f} ms "
+          f"({len(entries) / best:.0f} entry/s)")
+
+    members = {}
+    for (title, _), cluster_id in zip(entries, assignments):
+        members.setdefault(cluster_id, []).append(title)
+    multi = [titles for titles in members.values() if len(titles) > 1]
+    print(f"  {len(members)} cluster, {len(multi)} con più di un articolo")
+    for titles in multi[:5]:
+        print("   - " + "\n     ".join(t[:80] for t in titles))
+
+
+if __name__ == "__main__":
+    main()
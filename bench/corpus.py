@@ -0,0 +1,26 @@
+import os
+import re
+import glob
+
+import feedparser
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "feeds")
+
+
+def fixture_path(source):
+    slug = re.sub(r"[^a-z0-9]+", "-", source.lower()).strip("-")
+    return os.path.join(FIXTURES_DIR, f"{slug}.xml")
+
+
+def load_entries():
+    # (title, summary) di tutte le entry registrate, già ripulite dall'HTML come in fetch_all
+    entries = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.xml"))):
+        with open(path, "rb") as f:
+            feed = feedparser.parse(f.read())
+        for entry in feed.entries[:30]:
+            title = entry.get("title", "")
+            summary = re.sub(r"<[^>]+>", "", entry.get("summary", ""))
+            if title:
+                entries.append((title, summary))
+    return entries
@@ -0,0 +1,59 @@
+# Implementazioni originali, conservate come riferimento per benchmark e confronti.
+from collections import defaultdict
+
+from app import ALL_KEYWORDS, CATEGORY_TAGS
+
+
+def categorize(text):
+    text_lower = text.lower()
+    for cat, keys in CATEGORY_TAGS.items():
+        if cat == "⚪ Altro":
+            continue
+        for k in keys:
+            if k in text_lower:
+                return cat
+    return "⚪ Altro"
+
+
+def is_relevant(title, summary=""):
+    text = (title + " " + summary).lower()
+    return any(kw in text for kw in ALL_KEYWORDS)
+
+
+def select_balanced_articles(all_articles, max_total=25, max_per_perspective=4):
+    by_perspective = defaultdict(list)
+    for a in all_articles:
+        by_perspective[a.get('perspective', 'other')].append(a)
+
+    selected = []
+    seen_links = set()
+
+    top = all_articles[:10]
+    for a in top:
+        if a['link'] not in seen_links:
+            selected.append(a)
+            seen_links.add(a['link'])
+
+    perspectives = list(by_perspective.keys())
+    per_perspective_count = defaultdict(int)
+    for a in selected:
+        per_perspective_count[a.get('perspective', 'other')] += 1
+
+    remaining = [a for a in all_articles[10:] if a['link'] not in seen_links]
+    i = 0
+    while len(selected) < max_total and i < len(remaining) * 2:
+        for persp in perspectives:
+            if len(selected) >= max_total:
+                break
+            candidates = [a for a in remaining
+                         if a.get('perspective') == persp
+                         and a['link'] not in seen_links
+                         and per_perspective_count[persp] < max_per_perspective]
+            if candidates:
+                a = candidates[0]
+                selected.append(a)
+                seen_links.add(a['link'])
+                per_perspective_count[persp] += 1
+        i += 1
+
+    return selected
@@ -0,0 +1,97 @@
+"""Micro-benchmark: match_entry contro is_relevant + categorize originali.
+
+    python -m bench.matcher [--repeat N]
+"""
+import argparse
+import time
+
+from app import match_entry
+from bench import legacy
+from bench.corpus import load_entries
+
+
+# Casi fissi su chiavi ambigue e parole composte: (testo, chiave, attesa tra i termini trovati)
+CASES = [
+    ("Warships deployed near the strait", "war", True),
+    ("Wartime economy under pressure", "war", True),
+    ("War in Sudan enters third year", "war", True),
+    ("Postwar order under strain", "war", True),     # sottostringa, come in legacy
+    ("Antiwar voices grow", "war", True),
+    ("La controffensiva di Kiev", "offensiva", True),
+    ("Il contrattacco", "attacco", True),
+    ("Counterattack near Bakhmut", "attack", True),
+    ("A cyberattack hit Kyiv", "attack", True),
+    ("Questione di malinconia", "ue", False),
+    ("Questione di malinconia", "mali", False),
+    ("Europe weighs new tariffs", "eu", False),
+    ("Attentato in Mali, colpito un convoglio", "mali", True),
+    ("Vertice UE sui dazi", "ue", True),
+    ("Coupon codes for the weekend", "coup", False),
+]
+
+
+def check_cases():
+    failed = []
+    for text, key, expected in CASES:
+        found = key in match_entry(text)[2]
+        if found != expected:
+            failed.append((text, key, expected))
+    return failed
+
+
+def run_legacy(entries):
+    out = []
+    for title, summary in entries:
+        if legacy.is_relevant(title, summary):
+            out.append((True, legacy.categorize(title + " " + summary)))
+        else:
+            out.append((False, None))
+    return out
+
+
+def run_matcher(entries):
+    out = []
+    for title, summary in entries:
+        relevant, category, _ = match_entry(title + " " + summary)
+        out.append((relevant, category if relevant else None))
+    return out
+
+
+def timeit(fn, entries, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(entries)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    entries = load_entries()
+    t_legacy = timeit(run_legacy, entries, args.repeat)
+    t_matcher = timeit(run_matcher, entries, args.repeat)
+    print(f"{len(entries)} entry, best of {args.repeat}")
+    print(f"  legacy   {t_legacy * 1e3:8.2f} ms  {len(entries) / t_legacy:10.0f} entry/s")
+    print(f"  matcher  {t_matcher * 1e3:8.2f} ms  {len(entries) / t_matcher:10.0f} entry/s")
+    print(f"  speedup  {t_legacy / t_matcher:8.2f}x")
+
+    # Le differenze attese vengono solo dalle chiavi ambigue ("eu", "ue", "mali", "coup"...)
+    diffs = [(e, a, b) for e, a, b in zip(entries, run_legacy(entries), run_matcher(entries)) if a != b]
+    print(f"  {len(diffs)} entry classificate diversamente")
+    for (title, _), old, new in diffs[:10]:
+        print(f"    {title[:70]!r}: {old} → {new}")
+
+    failed = check_cases()
+    print(f"  casi fissi: {len(CASES) - len(failed)}/{len(CASES)} corretti")
+    for text, key, expected in failed:
+        print(f"    {text!r}: {key!r} {'atteso' if expected else 'inatteso'}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
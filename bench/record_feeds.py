@@ -0,0 +1,30 @@
+"""Registra i FEEDS correnti in bench/fixtures/feeds/ per i benchmark offline.
+
+    python -m bench.record_feeds
+
+Le fixture nel repo sono sintetiche (stessa forma dei feed reali, contenuti
+deterministici): rieseguire questo script per sostituirle con una registrazione reale.
+"""
+import os
+import urllib.request
+
+from app import FEEDS, FETCH_USER_AGENT
+from bench.corpus import FIXTURES_DIR, fixture_path
+
+
+def main():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for source, (url, _) in FEEDS.items():
+        try:
+            req = urllib.request.Request(url, headers={"User-Agent": FETCH_USER_AGENT})
+            with urllib.request.urlopen(req, timeout=20) as resp:
+                body = resp.read()
+            with open(fixture_path(source), "wb") as f:
+                f.write(body)
+            print(f"  [{source}] {len(body)} bytes")
+        except Exception as e:
+            print(f"  [{source}] errore: {e}")
+
+
+if __name__ == "__main__":
+    main()
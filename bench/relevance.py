@@ -0,0 +1,69 @@
+"""Benchmark dell'indice TF-IDF di rilevanza su un archivio sintetico.
+
+    python -m bench.relevance [--docs N] [--candidates K] [--repeat N]
+
+Le entry delle fixture vengono replicate fino a N documenti; si misurano costruzione,
+punteggio di K candidati per tema (come in api_analyze), snapshot e ricaricamento in mmap.
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from app import RelevanceIndex
+from bench.corpus import load_entries
+from bench.run import TOPICS
+
+
+def build(entries, docs, batch=5000):
+    index = RelevanceIndex()
+    for start in range(0, docs, batch):
+        ids = list(range(start + 1, min(start + batch, docs) + 1))
+        index.add(ids, [entries[(i - 1) % len(entries)] for i in ids])
+    index.merge()
+    return index
+
+
+def best_of(repeat, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - started)
+    return value, best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--candidates", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    entries = load_entries()
+    started = time.perf_counter()
+    index = build(entries, args.docs)
+    print(f"costruzione: {args.docs} documenti in {time.perf_counter() - started:.1f} s "
+          f"({index.chunks[0][1].nnz} termini)")
+
+    rng = random.Random(7)
+    candidates = [rng.sample(range(1, args.docs + 1), args.candidates) for _ in TOPICS]
+    for keywords, ids in zip(TOPICS, candidates):
+        scores, best = best_of(args.repeat, lambda: index.score(keywords, ids))
+        print(f"  {'+'.join(keywords):<16}{len(ids)} candidati: {best * 1e3:6.2f} ms, "
+              f"{int((scores > 0).sum())} pertinenti")
+
+    with tempfile.TemporaryDirectory() as directory:
+        _, saved = best_of(1, lambda: index.save(directory))
+        loaded, load_s = best_of(1, lambda: RelevanceIndex.load(directory))
+        print(f"snapshot: salvato in {saved * 1e3:.0f} ms, ricaricato (mmap) in {load_s * 1e3:.1f} ms")
+        for keywords, ids in zip(TOPICS, candidates):
+            assert np.allclose(index.score(keywords, ids), loaded.score(keywords, ids))
+        _, best = best_of(args.repeat, lambda: loaded.score(TOPICS[0], candidates[0]))
+        print(f"  punteggio dopo il caricamento: {best * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""Benchmark end-to-end offline della pipeline: ingestione, selezione e analisi.
+
+    python -m bench.run [--repeat N] [--warmup N] [--database-url URL] [--claude-latency-ms MS]
+    python -m bench.run --save-baseline          # registra bench/baseline.json
+    python -m bench.run --check [--tolerance 0.3] # esce con 1 se una fase regredisce
+
+Ogni fase è riportata come mediana delle ripetizioni. Il controllo allarga la tolleranza
+allo scarto osservato fra le ripetizioni e non segnala le fasi più brevi di
+--min-stage-ms, dove il rumore del timer domina.
+
+I feed sono le fixture di bench/fixtures/feeds, servite da un server HTTP locale così
+che fetch_feed giri per intero (GET condizionali e 304 compresi). Claude è sostituito
+da un client che restituisce un'analisi preconfezionata in streaming.
+
+Senza --database-url (o BENCH_DATABASE_URL) il DB è sostituito da un archivio in
+memoria: le query Postgres (tsvector, ON CONFLICT, advisory lock) non hanno un
+equivalente SQLite fedele, quindi in quella modalità si misura il Python della
+pipeline e non l'SQL. Con un Postgres locale tutto gira in uno schema temporaneo
+bench_<pid>, eliminato alla fine.
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import quote
+
+import psycopg2
+import psycopg2.extras
+
+import app
+from bench.corpus import fixture_path
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+TOPICS = [["gaza"], ["ukraine", "ucraina"], ["iran"], ["sudan"], ["taiwan", "china"], ["nato"]]
+WARM_CYCLES = 5
+
+
+# ── Feed registrati ──────────────────────────────────────────────────────────
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            with open(os.path.join(os.path.dirname(fixture_path("x")), self.path.lstrip("/")), "rb") as f:
+                body = f.read()
+        except OSError:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FixtureServer(ThreadingHTTPServer):
+    # Il backlog di default (5) con FETCH_WORKERS connessioni simultanee fa scattare
+    # la ritrasmissione del SYN dopo 1 s: si misurerebbe il kernel, non la pipeline
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def serve_fixtures():
+    server = FixtureServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    app.FEEDS = {source: (f"http://127.0.0.1:{port}/{quote(os.path.basename(fixture_path(source)))}", perspective)
+                 for source, (_, perspective) in app.FEEDS.items()}
+    return server
+
+
+# ── Claude simulato ──────────────────────────────────────────────────────────
+def canned_analysis():
+    paragraph = ("Le fonti concordano sui fatti principali ma divergono sulla responsabilità "
+                 "e sul quadro giuridico; il silenzio di alcune testate è esso stesso narrativa. ")
+    return "\n\n".join(f"## {title}\n" + paragraph * 6 for _, title in app.SECTIONS[:-1]) + \
+        "\n\n## 6. SCRIPT INSTAGRAM (90 secondi, bilingue IT/EN)\n" + paragraph * 10
+
+
+class StubStream:
+    def __init__(self, text, latency):
+        self.text = text
+        self.latency = latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        chunks = [self.text[i:i + 40] for i in range(0, len(self.text), 40)]
+        for chunk in chunks:
+            if self.latency:
+                time.sleep(self.latency / len(chunks))
+            yield chunk
+
+    def get_final_message(self):
+        return stub_message(self.text)
+
+
+def stub_message(text):
+    usage = SimpleNamespace(input_tokens=2500, output_tokens=len(text) // 4,
+                            cache_read_input_tokens=1800, cache_creation_input_tokens=0)
+    return SimpleNamespace(content=[SimpleNamespace(text=text)], usage=usage)
+
+
+class StubClaude:
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.text = canned_analysis()
+        self.calls = 0
+        self.beta = SimpleNamespace(prompt_caching=SimpleNamespace(messages=self))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return stub_message(self.text)
+
+    def stream(self, **kwargs):
+        self.calls += 1
+        return StubStream(self.text, self.latency)
+
+
+# ── Archivio in memoria ──────────────────────────────────────────────────────
+class MemoryStore:
+    # Sostituisce le funzioni di accesso al DB con strutture in memoria equivalenti
+    def __init__(self):
+        self.articles = {}
+        self.feed_states = {}
+        self.cycles = []
+        self.analyses = []
+        self.index = app.ClusterIndex()
+
+    def install(self):
+        app.db = self.db
+        app.load_feed_states = lambda: dict(self.feed_states)
+        app.save_feed_states = self.save_feed_states
+        app.save_articles = self.save_articles
+        app.record_ingest_cycle = lambda cycle_at, stages, sources: self.cycles.append(stages)
+        app.search_articles = self.search_articles
+        app.find_previous_analyses = lambda c, keywords, limit=2: []
+        app.save_analysis = self.save_analysis
+        app.store_cached_analysis = lambda key, analysis_id, result: None
+        app.finish_job = lambda job_id, result=None, error=None: None
+
+    @contextmanager
+    def db(self):
+        cursor = SimpleNamespace(execute=lambda *a, **k: None, fetchone=lambda: (True,), fetchall=lambda: [])
+        yield SimpleNamespace(cursor=lambda **k: cursor, commit=lambda: None)
+
+    def save_feed_states(self, results, states):
+        now = datetime.now(timezone.utc)
+        for r in results:
+            plan = app.plan_next_fetch(states.get(r["source"]), r, now)
+            self.feed_states[r["source"]] = {
+                "etag": r["etag"], "last_modified": r["last_modified"], "last_fetched_at": now,
+                "latest_entry_at": r.get("newest_entry_at"), **plan,
+            }
+
+    def save_articles(self, rows):
+        inserted = {}
+        now = datetime.now(timezone.utc)
+        for source, title, link, summary, published, category, perspective in rows:
+            if link in self.articles:
+                continue
+            article_id = len(self.articles) + 1
+            signature = app.minhash_signature(title, summary)
+            cluster_id = article_id
+            if signature:
+                cluster_id = self.index.match(signature) or article_id
+                self.index.add(article_id, cluster_id, signature, now)
+            self.articles[link] = {"id": article_id, "source": source, "title": title, "link": link,
+                                   "summary": summary, "published": published, "category": category,
+                                   "perspective": perspective, "cluster_id": cluster_id,
+                                   "fetched_at": now}
+            inserted[source] = inserted.get(source, 0) + 1
+        return inserted, set()
+
+    def search_articles(self, c, keywords, limit=500, since=None, fetched_after=None):
+        hits = [a for a in self.articles.values()
+                if any(kw in (a["title"] + " " + a["summary"]).lower() for kw in keywords)
+                and (not since or (a["published"] and a["published"] >= since))
+                and (not fetched_after or a["fetched_at"] > fetched_after)]
+        return sorted(hits, key=lambda a: -a["id"])[:limit]
+
+    def save_analysis(self, *args, usage=None, **kwargs):
+        self.analyses.append(args)
+        return len(self.analyses)
+
+
+# ── Postgres locale ──────────────────────────────────────────────────────────
+class PostgresStore:
+    def __init__(self, url, sslmode):
+        self.url = url
+        self.sslmode = sslmode
+        self.schema = f"bench_{os.getpid()}"
+
+    def install(self):
+        with psycopg2.connect(self.url, sslmode=self.sslmode) as conn:
+            conn.cursor().execute(f"CREATE SCHEMA IF NOT EXISTS {self.schema}")
+        sep = "&" if "?" in self.url else "?"
+        app.DATABASE_URL = f"{self.url}{sep}options=-csearch_path%3D{self.schema}"
+        app.DB_SSLMODE = self.sslmode
+        app.init_db()
+
+    def reset(self):
+        with app.db() as conn:
+            c = conn.cursor()
+            c.execute("""TRUNCATE articles, articles_archive, feed_state, article_stats, ingest_cycles,
+                                  feed_metrics, analyses, analysis_cache, jobs, trend_buckets RESTART IDENTITY CASCADE""")
+            c.execute("UPDATE stats_meta SET version = 1, last_update = NULL, archived = 0")
+        app.reset_cluster_index()
+
+    def close(self):
+        if app._pool:
+            app._pool.closeall()
+        with psycopg2.connect(self.url, sslmode=self.sslmode) as conn:
+            conn.cursor().execute(f"DROP SCHEMA IF EXISTS {self.schema} CASCADE")
+
+
+# ── Fasi ─────────────────────────────────────────────────────────────────────
+def timed(fn, *args):
+    started = time.perf_counter()
+    value = fn(*args)
+    return value, (time.perf_counter() - started) * 1000
+
+
+def stage(name, latencies_ms, ops=None, extra=None):
+    ops = ops if ops is not None else len(latencies_ms)
+    total = sum(latencies_ms)
+    ordered = sorted(latencies_ms)
+    return {
+        "stage": name, "ops": ops, "total_ms": round(total, 2),
+        "ops_per_s": round(ops / (total / 1000), 1) if total else 0.0,
+        "p50_ms": round(statistics.median(ordered), 3) if ordered else 0.0,
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3) if ordered else 0.0,
+        **(extra or {}),
+    }
+
+
+def run_once(store, claude):
+    results = []
+
+    # fetch + parse di ogni feed, in sequenza: latenza per fonte
+    fetched = [timed(app.fetch_feed, source, url, None) for source, (url, _) in app.FEEDS.items()]
+    entries = [e for res, _ in fetched for e in res["entries"]]
+    results.append(stage("fetch_parse", [ms for _, ms in fetched],
+                         extra={"bytes": sum(res["bytes"] for res, _ in fetched), "entries": len(entries)}))
+
+    # filtro keyword + categoria (is_relevant/categorize in un solo passaggio)
+    texts = [e.get("title", "") + " " + e.get("summary", "") for e in entries]
+    latencies = []
+    for text in texts:
+        latencies.append(timed(app.match_entry, text)[1])
+    results.append(stage("filter", latencies))
+
+    # ciclo completo a DB vuoto (tutte inserzioni) e poi a regime (304 e duplicati);
+    # il ciclo a regime dura pochi ms e va ripetuto per non misurare solo rumore
+    for name, count in (("cycle_cold", 1), ("cycle_warm", WARM_CYCLES)):
+        cycles = []
+        latencies = []
+        original = app.record_ingest_cycle
+        app.record_ingest_cycle = lambda cycle_at, stages, sources: cycles.append(stages)
+        try:
+            for _ in range(count):
+                inserted, ms = timed(app._fetch_cycle)
+                latencies.append(ms)
+        finally:
+            app.record_ingest_cycle = original
+        if isinstance(store, MemoryStore):
+            store.cycles.extend(cycles)
+        # ripartizione del primo ciclo; il totale della fase resta quello misurato qui
+        breakdown = {k: v for k, v in cycles[0].items() if k != "total_ms"} if cycles else {}
+        results.append(stage(name, latencies, ops=len(app.FEEDS) * count,
+                             extra={"inserted": inserted, **breakdown}))
+
+    # ricerca + selezione bilanciata per ogni tema
+    latencies = []
+    selections = []
+    for keywords in TOPICS:
+        started = time.perf_counter()
+        with app.db() as conn:
+            found = app.search_articles(conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor), keywords)
+        selected = app.select_balanced_articles(found, max_total=25, max_per_perspective=4,
+                                                policy=app.ANALYSIS_SELECTION_POLICY)
+        latencies.append((time.perf_counter() - started) * 1000)
+        selections.append((keywords, selected))
+    results.append(stage("select", latencies, extra={"selected": sum(len(s) for _, s in selections)}))
+
+    # parsing delle sezioni e job di analisi completo con Claude simulato
+    raw = claude.text
+    results.append(stage("parse_sections", [timed(app.parse_sections, raw)[1] for _ in range(200)]))
+    latencies = []
+    for i, (keywords, selected) in enumerate(selections):
+        if selected:
+            latencies.append(timed(app.run_analysis_job, f"bench-{os.getpid()}-{i}", keywords, selected, [])[1])
+    results.append(stage("analysis_job", latencies))
+    return results
+
+
+def merge(runs):
+    # Per ogni fase la ripetizione mediana per throughput, più lo scarto interquartile
+    # relativo fra le ripetizioni, usato dal controllo come tolleranza minima
+    by_stage = {}
+    for run in runs:
+        for r in run:
+            by_stage.setdefault(r["stage"], []).append(r)
+    merged = []
+    for records in by_stage.values():
+        records.sort(key=lambda r: r["ops_per_s"])
+        median = records[len(records) // 2]
+        low, high = records[len(records) // 4], records[-1 - len(records) // 4]
+        spread = (high["ops_per_s"] - low["ops_per_s"]) / median["ops_per_s"] if median["ops_per_s"] else 0.0
+        merged.append({**median, "spread": round(spread, 3)})
+    return merged
+
+
+def print_report(results, mode):
+    print(f"modalità DB: {mode}")
+    print(f"  {'fase':<15}{'ops':>7}{'totale ms':>12}{'ops/s':>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for r in results:
+        print(f"  {r['stage']:<15}{r['ops']:>7}{r['total_ms']:>12.1f}{r['ops_per_s']:>12.1f}"
+              f"{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}")
+        details = {k: v for k, v in r.items() if k not in ("stage", "ops", "total_ms", "ops_per_s", "p50_ms", "p95_ms")}
+        if details:
+            print("  " + " " * 15 + ", ".join(f"{k}={v}" for k, v in details.items()))
+
+
+def check_baseline(results, mode, tolerance, min_stage_ms):
+    with open(BASELINE_PATH) as f:
+        baseline = json.load(f)
+    if baseline.get("mode") != mode:
+        print(f"[WARN] baseline registrata in modalità {baseline.get('mode')}, esecuzione in {mode}")
+    regressions = []
+    for r in results:
+        base = baseline["stages"].get(r["stage"])
+        if not base or not base["ops_per_s"]:
+            continue
+        change = r["ops_per_s"] / base["ops_per_s"] - 1
+        allowed = max(tolerance, r.get("spread", 0.0))
+        if r["total_ms"] < min_stage_ms:
+            flag = "(troppo breve, non valutata)"
+        else:
+            flag = "REGRESSIONE" if change < -allowed else ""
+        print(f"  {r['stage']:<15}{base['ops_per_s']:>12.1f} → {r['ops_per_s']:>10.1f} ops/s  "
+              f"{change:+7.1%} (±{allowed:.0%}) {flag}")
+        if flag == "REGRESSIONE":
+            regressions.append(r["stage"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL", ""))
+    parser.add_argument("--sslmode", default="disable")
+    parser.add_argument("--claude-latency-ms", type=float, default=0)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--min-stage-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    app.ANTHROPIC_API_KEY = app.ANTHROPIC_API_KEY or "bench"
+    claude = StubClaude(args.claude_latency_ms)
+    app.set_claude_client(claude)
+    # Il client simulato non ha limiti: il governor fermerebbe le ripetizioni sul TPM
+    app._claude_governor = app.RateGovernor(0, 0)
+    server = serve_fixtures()
+
+    mode = "postgres" if args.database_url else "memory"
+    pg = PostgresStore(args.database_url, args.sslmode) if args.database_url else None
+    if pg:
+        pg.install()
+    runs = []
+    try:
+        for i in range(args.warmup + args.repeat):
+            if pg:
+                pg.reset()
+                store = pg
+            else:
+                store = MemoryStore()
+                store.install()
+            results = run_once(store, claude)
+            if i >= args.warmup:
+                # le prime esecuzioni pagano import pigri e cache fredde: scartate
+                runs.append(results)
+    finally:
+        server.shutdown()
+        if pg:
+            pg.close()
+
+    results = merge(runs)
+    print_report(results, mode)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({"mode": mode, "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                       "python": sys.version.split()[0],
+                       "stages": {r["stage"]: {"ops_per_s": r["ops_per_s"], "p95_ms": r["p95_ms"]} for r in results}},
+                      f, indent=2)
+            f.write("\n")
+        print(f"baseline salvata in {BASELINE_PATH}")
+    if args.check:
+        regressions = check_baseline(results, mode, args.tolerance, args.min_stage_ms)
+        if regressions:
+            print(f"regressioni oltre la tolleranza: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
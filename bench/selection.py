@@ -0,0 +1,82 @@
+"""Benchmark e verifica di select_balanced_articles contro il round-robin originale.
+
+    python -m bench.selection [--rows N] [--cases N] [--repeat N]
+
+Prima confronta le due implementazioni su input casuali (stessa uscita attesa con la
+politica di default), poi misura i tempi sulle dimensioni reali di /api/admin/analyze.
+"""
+import argparse
+import random
+import sys
+import time
+
+from app import FEEDS, select_balanced_articles
+from bench import legacy
+
+SOURCES = list(FEEDS)
+PERSPECTIVES = sorted({p for _, p in FEEDS.values()})
+
+
+def random_articles(rng, rows):
+    # Link ripetuti e prospettive sbilanciate come nei risultati reali della ricerca
+    articles = []
+    for i in range(rows):
+        source = rng.choice(SOURCES)
+        articles.append({
+            "title": f"Articolo {i}",
+            "link": f"https://example.org/{rng.randrange(rows)}",
+            "source": source,
+            "perspective": rng.choice(PERSPECTIVES[:rng.randint(1, len(PERSPECTIVES))]),
+        })
+    return articles
+
+
+def check(cases, rows, seed):
+    rng = random.Random(seed)
+    failures = 0
+    for case in range(cases):
+        articles = random_articles(rng, rng.randint(0, rows))
+        max_total = rng.choice([5, 10, 25, 40])
+        max_per_perspective = rng.choice([1, 2, 4, 8])
+        expected = legacy.select_balanced_articles(articles, max_total, max_per_perspective)
+        got = select_balanced_articles(articles, max_total, max_per_perspective)
+        if [a["link"] for a in got] != [a["link"] for a in expected]:
+            failures += 1
+            print(f"  caso {case}: {len(articles)} righe, max_total={max_total}, "
+                  f"max_per_perspective={max_per_perspective} → uscite diverse")
+    return failures
+
+
+def timeit(fn, articles, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(articles, 25, 4)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=13)
+    args = parser.parse_args()
+
+    failures = check(args.cases, args.rows, args.seed)
+    print(f"{args.cases} casi casuali fino a {args.rows} righe: {failures} differenze")
+
+    articles = random_articles(random.Random(args.seed), args.rows)
+    t_legacy = timeit(legacy.select_balanced_articles, articles, args.repeat)
+    t_new = timeit(select_balanced_articles, articles, args.repeat)
+    print(f"{args.rows} righe, best of {args.repeat}")
+    print(f"  legacy   {t_legacy * 1e3:8.3f} ms")
+    print(f"  deque    {t_new * 1e3:8.3f} ms")
+    print(f"  speedup  {t_legacy / t_new:8.1f}x")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
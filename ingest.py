@@ -0,0 +1,33 @@
+# Processo di ingestione: migrazioni e poi polling adattivo per fonte.
+#   python ingest.py          → scheduler bloccante (servizio worker), un tick al minuto
+#   python ingest.py --once   → un ciclo su tutte le fonti, per cron o per il debug
+#   python ingest.py --compact → sposta in archivio gli articoli oltre l'orizzonte caldo ed esce
+# Più istanze possono girare insieme: fetch_all prende un advisory lock e chi non lo
+# ottiene salta il giro, quindi c'è sempre un solo fetcher attivo.
+import argparse
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+from app import init_db, fetch_all, compact_articles, schedule_ingestion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestione dei feed RSS di Theatrum Belli")
+    parser.add_argument("--once", action="store_true", help="esegue un solo ciclo ed esce")
+    parser.add_argument("--compact", action="store_true", help="esegue solo la compattazione dell'archivio")
+    args = parser.parse_args()
+
+    init_db()
+    if args.compact:
+        compact_articles()
+        return
+    if args.once:
+        inserted = fetch_all()
+        print(f"[INGEST] {inserted} nuovi articoli.")
+        return
+    print("[INGEST] scheduler avviato.")
+    schedule_ingestion(BlockingScheduler()).start()
+
+
+if __name__ == "__main__":
+    main()
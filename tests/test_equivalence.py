@@ -0,0 +1,235 @@
+"""Confronti fra le implementazioni originali (bench/legacy.py) e quelle attuali.
+
+Corpora casuali a seme fisso: ogni esecuzione vede gli stessi casi, e un fallimento
+riporta il seme e l'input che lo riproducono.
+"""
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app
+from bench import legacy
+from bench.corpus import load_entries
+from bench.selection import random_articles
+
+SEEDS = range(5)
+
+
+# ── Selezione ────────────────────────────────────────────────────────────────
+@pytest.mark.parametrize("seed", SEEDS)
+def test_selection_matches_legacy_round_robin(seed):
+    rng = random.Random(seed)
+    for _ in range(100):
+        articles = random_articles(rng, rng.randint(0, 500))
+        max_total = rng.choice([5, 10, 25, 40])
+        max_per_perspective = rng.choice([1, 2, 4, 8])
+        expected = legacy.select_balanced_articles(articles, max_total, max_per_perspective)
+        got = app.select_balanced_articles(articles, max_total, max_per_perspective)
+        assert [a["link"] for a in got] == [a["link"] for a in expected], \
+            (seed, len(articles), max_total, max_per_perspective)
+
+
+def test_selection_default_policy_matches_legacy():
+    rng = random.Random(99)
+    for _ in range(20):
+        articles = random_articles(rng, 500)
+        expected = legacy.select_balanced_articles(articles, 25, 4)
+        got = app.select_balanced_articles(articles, 25, 4, policy=dict(app.DEFAULT_SELECTION_POLICY))
+        assert [a["link"] for a in got] == [a["link"] for a in expected]
+
+
+# ── Matcher ──────────────────────────────────────────────────────────────────
+# Su testi fatti di parole intere il matcher e la ricerca per sottostringa devono
+# coincidere. Restano fuori le chiavi che già da sole classificano
+# diversamente perché ne contengono una ambigua ("guerra" ⊃ "ue"), e i riempitivi
+# che contengono una chiave
+ALL_KEYS = app.ALL_KEYWORDS.union(*app.CATEGORY_TAGS.values())
+KEYS = sorted(k for k in ALL_KEYS
+              if app.match_entry(k)[:2] == (legacy.is_relevant(k), legacy.categorize(k)))
+FILLER = [w for w in (
+    "il governo ha annunciato nuove misure oggi mentre la popolazione attende notizie "
+    "the minister said talks could resume next month despite growing pressure at home "
+    "rapporto economia mercati elezioni parlamento sindaco scuola sanità calcio meteo"
+).split() if not any(k in w for k in ALL_KEYS)]
+
+
+def random_text(rng):
+    words = []
+    for _ in range(rng.randint(1, 12)):
+        if rng.random() < 0.3:
+            word = rng.choice(KEYS) + rng.choice(["", "", "s"])
+        else:
+            word = rng.choice(FILLER)
+        words.append(word.title() if rng.random() < 0.3 else word)
+    return " ".join(words)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_matcher_matches_legacy_on_whole_words(seed):
+    rng = random.Random(seed)
+    for _ in range(2000):
+        text = random_text(rng)
+        relevant, category, _ = app.match_entry(text)
+        assert relevant == legacy.is_relevant(text), (seed, text)
+        assert category == legacy.categorize(text), (seed, text)
+
+
+@pytest.mark.parametrize("text,key", [
+    ("Europe weighs new tariffs", "eu"),
+    ("Questione aperta", "ue"),
+    ("Somalia, colloqui a Mogadiscio", "mali"),
+    ("Coupon codes for the weekend", "coup"),
+])
+def test_matcher_ambiguous_keys_need_whole_words(text, key):
+    assert key not in app.match_entry(text)[2]
+
+
+@pytest.mark.parametrize("text", [
+    "Warships in the strait", "Wartime budget", "Palestinese ferito",
+    # parole composte: le chiavi non ambigue restano sottostringhe
+    "La controffensiva di Kiev", "Il contrattacco", "counterattack near Bakhmut",
+    "A cyberattack hit Kyiv", "Antiwar voices grow", "Postwar order in Europe",
+])
+def test_matcher_keeps_substring_matching(text):
+    assert app.match_entry(text)[:2] == (legacy.is_relevant(text), legacy.categorize(text))
+    assert app.match_entry(text)[0] is True
+
+
+def test_matcher_agrees_with_legacy_on_fixture_feeds():
+    # Sulle entry reali le differenze possono venire solo dalle chiavi ambigue
+    plain = app.ALL_KEYWORDS - app.WHOLE_WORD_KEYS
+    for title, summary in load_entries():
+        text = title + " " + summary
+        if app.match_entry(text)[0] != legacy.is_relevant(title, summary):
+            assert not any(k in text.lower() for k in plain), text
+
+
+# ── Clustering ───────────────────────────────────────────────────────────────
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a | b else 0.0
+
+
+def perturb(rng, title):
+    words = title.split()
+    for _ in range(rng.randint(0, 2)):
+        if len(words) > 3:
+            words.pop(rng.randrange(len(words)))
+    return " ".join(words)
+
+
+def near_duplicates(seed, count=300):
+    rng = random.Random(seed)
+    entries = load_entries()
+    out = []
+    for _ in range(count):
+        title, summary = rng.choice(entries)
+        out.append((perturb(rng, title), summary))
+    return out
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_minhash_estimates_jaccard(seed):
+    rng = random.Random(seed)
+    errors = []
+    for title, summary in near_duplicates(seed, 200):
+        other = perturb(rng, title)
+        a = app.minhash_signature(title, summary)
+        b = app.minhash_signature(other, summary)
+        if a is None or b is None:
+            continue
+        exact = jaccard(app._cluster_shingles(title, summary), app._cluster_shingles(other, summary))
+        estimate = sum(x == y for x, y in zip(a, b)) / app.MINHASH_SIZE
+        errors.append(abs(estimate - exact))
+    # 32 permutazioni: errore standard ≤ 0.09, in media molto meno
+    assert sum(errors) / len(errors) < 0.06
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_lsh_matches_brute_force(seed):
+    # Riferimento: confronto della firma con tutte quelle già viste. L'LSH può perdere
+    # coppie poco simili ma non deve mai proporre un cluster sotto soglia, e sopra 0.8
+    # deve trovare lo stesso livello di somiglianza della scansione completa
+    index = app.ClusterIndex()
+    seen = {}
+    now = datetime.now(timezone.utc)
+    for article_id, (title, summary) in enumerate(near_duplicates(seed), start=1):
+        signature = app.minhash_signature(title, summary)
+        if signature is None:
+            continue
+        scores = {other_id: sum(x == y for x, y in zip(signature, other)) / app.MINHASH_SIZE
+                  for other_id, (_, other) in seen.items()}
+        best = max(scores.values(), default=0.0)
+        cluster_id = index.match(signature)
+        if cluster_id is not None:
+            assert any(seen[i][0] == cluster_id and s >= app.CLUSTER_THRESHOLD for i, s in scores.items())
+        if best >= 0.8:
+            assert cluster_id is not None, (seed, title)
+        cluster_id = cluster_id or article_id
+        index.add(article_id, cluster_id, signature, now)
+        seen[article_id] = (cluster_id, signature)
+
+
+def test_pruned_index_matches_rebuilt_index():
+    # Potatura incrementale contro ricostruzione da zero (come _load_cluster_index)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    pruned = app.ClusterIndex()
+    rows = []
+    for article_id, (title, summary) in enumerate(near_duplicates(7), start=1):
+        signature = app.minhash_signature(title, summary)
+        if signature is None:
+            continue
+        fetched_at = start + timedelta(minutes=article_id)
+        cluster_id = pruned.match(signature) or article_id
+        pruned.add(article_id, cluster_id, signature, fetched_at)
+        rows.append((article_id, cluster_id, signature, fetched_at))
+    cutoff = start + timedelta(minutes=150)
+    pruned.prune(cutoff)
+    rebuilt = app.ClusterIndex()
+    for article_id, cluster_id, signature, fetched_at in rows:
+        if fetched_at >= cutoff:
+            rebuilt.add(article_id, cluster_id, signature, fetched_at)
+
+    assert pruned.entries == rebuilt.entries
+    assert dict(pruned.buckets) == dict(rebuilt.buckets)
+    for title, summary in near_duplicates(8, 100):
+        signature = app.minhash_signature(title, summary)
+        if signature:
+            assert pruned.match(signature) == rebuilt.match(signature)
+
+
+# ── Rilevanza ────────────────────────────────────────────────────────────────
+def build_index(docs, first_id=1, batch=97):
+    index = app.RelevanceIndex()
+    for start in range(0, len(docs), batch):
+        ids = list(range(first_id + start, first_id + min(start + batch, len(docs))))
+        index.add(ids, docs[start:start + batch])
+    return index
+
+
+def test_relevance_drop_matches_rebuild():
+    # Righe tolte dalla retention contro un indice ricostruito senza di esse
+    docs = load_entries()[:600]
+    index = build_index(docs)
+    index.drop_before(251)
+    rebuilt = build_index(docs[250:], first_id=251)
+    assert len(index) == len(rebuilt)
+    assert (index.df == rebuilt.df).all()
+    candidates = list(range(200, 601, 3))
+    for keywords in (["gaza"], ["ukraine", "ucraina"], ["taiwan", "china"]):
+        assert app.np.allclose(index.score(keywords, candidates), rebuilt.score(keywords, candidates))
+
+
+def test_relevance_snapshots_survive_newer_saves(tmp_path):
+    # Uno snapshot già caricato in mmap resta leggibile dopo i salvataggi successivi
+    docs = load_entries()[:300]
+    index = build_index(docs)
+    index.save(tmp_path)
+    loaded = app.RelevanceIndex.load(tmp_path)
+    expected = loaded.score(["gaza"], list(range(1, 301)))
+    for extra in range(app.TFIDF_KEEP_SNAPSHOTS + 2):
+        index.add([301 + extra], [("Gaza ceasefire talks resume", "")])
+        index.save(tmp_path)
+    assert app.np.allclose(loaded.score(["gaza"], list(range(1, 301))), expected)
+    assert len(app.RelevanceIndex.load(tmp_path)) == len(index)
+    assert len([p for p in tmp_path.iterdir() if p.name.startswith("v")]) == app.TFIDF_KEEP_SNAPSHOTS